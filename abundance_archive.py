@@ -0,0 +1,168 @@
+"""
+Append-only archive of chemical abundance profiles (species x zones), one
+per saved model, for a number of zones that changes between models.
+
+An archive is three files: `<name>.abund` with the profiles one after the
+other, `<name>.abund.idx` with one fixed-size record (step, age, offset,
+number of species and zones) per profile, and `<name>.abund.json` with the
+storage and the names of the species. Every profile is stored species by
+species, so reading one species only touches its own bytes, and reads are
+memory-mapped:
+
+    archive = AbundanceArchive("star-abundances", storage="log16")
+    archive.append(star.get_chemical_abundance_profiles(), step, age)
+    central_h = archive.species("h", zone=0)    # one value per model
+    profiles = archive.profiles(-1)             # the last model
+
+Profiles are stored as float64, as float32, or (log16) as the logarithm
+quantised to 16 bits between LOG_MIN and 0, a relative error of at most
+0.06%; abundances below 10**LOG_MIN are stored as 10**LOG_MIN.
+"""
+import os
+import json
+
+import numpy
+
+from index_file import load_index
+
+INDEX_DTYPE = numpy.dtype([
+    ("step", "<i8"),
+    ("age", "<f8"),
+    ("offset", "<u8"),
+    ("n_species", "<i4"),
+    ("n_zones", "<i4"),
+])
+STORAGE_DTYPES = {
+    "float64": numpy.dtype("<f8"),
+    "float32": numpy.dtype("<f4"),
+    "log16": numpy.dtype("<u2"),
+}
+LOG_MIN = -30.
+LOG_STEPS = 65535
+ALIGNMENT = 8
+
+
+class AbundanceArchive:
+    """
+    Abundance archive called name. storage (float64, float32 or log16)
+    and species (the names, in the order of the profiles) are only used
+    when the archive is created.
+    """
+    def __init__(self, name, storage="float64", species=None):
+        self.filename = name + ".abund"
+        self.index_filename = self.filename + ".idx"
+        self.meta_filename = self.filename + ".json"
+        if os.path.exists(self.meta_filename):
+            with open(self.meta_filename) as infile:
+                meta = json.load(infile)
+            storage = meta["storage"]
+            species = meta["species"]
+        if storage not in STORAGE_DTYPES:
+            raise ValueError(f"unknown storage {storage}")
+        self.storage = storage
+        self.dtype = STORAGE_DTYPES[storage]
+        self.species_names = None if species is None else list(species)
+        self.index = load_index(
+            self.index_filename, INDEX_DTYPE, self.filename, self.__nbytes
+        )
+        self.__data = None
+
+    def __nbytes(self, records):
+        return (
+            records["n_species"].astype("<u8")
+            * records["n_zones"].astype("<u8")
+            * self.dtype.itemsize
+        )
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def steps(self):
+        return self.index["step"]
+
+    @property
+    def ages(self):
+        return self.index["age"]
+
+    @property
+    def zones(self):
+        "The number of zones of every profile"
+        return self.index["n_zones"]
+
+    def encode(self, abundances):
+        if self.storage != "log16":
+            return abundances.astype(self.dtype)
+        log_abundances = numpy.log10(
+            numpy.maximum(abundances, 10**LOG_MIN)
+        )
+        return numpy.rint(
+            numpy.clip(log_abundances / LOG_MIN, 0, 1) * LOG_STEPS
+        ).astype(self.dtype)
+
+    def decode(self, stored):
+        if self.storage != "log16":
+            return stored
+        return 10**(stored * (LOG_MIN / LOG_STEPS))
+
+    def append(self, abundances, step=-1, age=numpy.nan):
+        "Append a profile, an array of (species, zones)"
+        abundances = numpy.asarray(abundances, dtype=float)
+        if abundances.ndim != 2:
+            raise ValueError("abundances must be an array of species x zones")
+        if not os.path.exists(self.meta_filename):
+            with open(self.meta_filename, "w") as outfile:
+                json.dump(
+                    {"storage": self.storage, "species": self.species_names},
+                    outfile,
+                )
+        data = numpy.ascontiguousarray(self.encode(abundances)).tobytes()
+        with open(self.filename, "ab") as outstream:
+            offset = outstream.tell()
+            if offset % ALIGNMENT:
+                outstream.write(bytes(ALIGNMENT - offset % ALIGNMENT))
+                offset = outstream.tell()
+            outstream.write(data)
+        record = numpy.array(
+            [(step, age, offset, *abundances.shape)], dtype=INDEX_DTYPE
+        )
+        with open(self.index_filename, "ab") as outstream:
+            record.tofile(outstream)
+        self.index = numpy.concatenate([self.index, record])
+
+    def __stored(self, row):
+        "The stored profile of row, memory-mapped"
+        record = self.index[row]
+        end = int(record["offset"] + self.__nbytes(record))
+        if self.__data is None or len(self.__data) < end:
+            self.__data = numpy.memmap(
+                self.filename, dtype=numpy.uint8, mode="r"
+            )
+        stored = self.__data[int(record["offset"]):end].view(self.dtype)
+        return stored.reshape(int(record["n_species"]), int(record["n_zones"]))
+
+    def profiles(self, row):
+        "The profiles (species x zones) of the row-th stored model"
+        return self.decode(self.__stored(row))
+
+    def species_index(self, species):
+        if isinstance(species, str):
+            if self.species_names is None:
+                raise KeyError("the archive has no species names")
+            return self.species_names.index(species)
+        return species
+
+    def species(self, species, zone=None, rows=None):
+        """
+        The profile of one species (index or name) in every stored model
+        (or only in rows), as a list of arrays, or with zone (0 is the
+        centre, -1 the surface) as one array of the values in that zone
+        """
+        species = self.species_index(species)
+        if rows is None:
+            rows = range(len(self))
+        if zone is None:
+            return [self.decode(self.__stored(row)[species]) for row in rows]
+        return self.decode(numpy.array(
+            [self.__stored(row)[species, zone] for row in rows],
+        ))
@@ -0,0 +1,100 @@
+"""
+Background writer for checkpoints and backups.
+Writing (pickling, compressing, HDF5) is done in a separate thread, so the
+GENEC worker doesn't wait for it. The queue is bounded: when the writer
+falls behind, submit() blocks until there is room again.
+
+    writer = BackgroundWriter()
+    writer.submit(write_genec_model, model)
+    ...
+    writer.close()          # also done at exit: waits until all is written
+
+Arguments are handed to the writer as they are, without copying, so they
+must not be changed after submitting them (fresh results of
+get_internal_structure() or particle.copy() are fine).
+
+write_checkpoint and stop_quietly are small helpers for the drivers, kept
+here so that they don't need to import the multi-worker scheduler.
+"""
+import os
+import queue
+import atexit
+import pickle
+import threading
+
+from amuse.support.exceptions import AmuseException
+
+
+def write_checkpoint(model, filename):
+    "Pickle a model, replacing filename only when it is complete"
+    with open(filename + ".tmp", "wb") as outstream:
+        pickle.dump(model, outstream)
+    os.replace(filename + ".tmp", filename)
+
+
+def stop_quietly(instance):
+    "Stop a GENEC worker, which may already have died"
+    try:
+        instance.stop()
+    except (AmuseException, OSError):
+        pass
+
+
+class BackgroundWriter:
+    def __init__(self, maxsize=4):
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def __run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                function, args, kwargs = job
+                function(*args, **kwargs)
+            except Exception as error:
+                if self.error is None:
+                    self.error = error
+            finally:
+                self.queue.task_done()
+
+    def __raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Call function(*args, **kwargs) in the writer thread. Blocks if the
+        queue is full, and raises any error of an earlier write.
+        """
+        if self.closed:
+            raise RuntimeError("writer is closed")
+        self.__raise_error()
+        self.queue.put((function, args, kwargs))
+
+    def flush(self):
+        "Wait until everything submitted has been written"
+        self.queue.join()
+        self.__raise_error()
+
+    def close(self):
+        "Write everything that is queued and stop the writer thread"
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        atexit.unregister(self.close)
+        self.__raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
@@ -1,38 +1,430 @@
 """
 Class for making GENEC work with more than one star.
 Will create a separate GENEC instance for each star so don't overdo it!
+With multiplex=True, stars beyond max_number_of_workers are parked as
+internal-structure models and swapped in and out of the workers.
+With placement (a policy name or a WorkerPlacement), each worker is pinned
+to its own cores.
+Swapped-in stars replace the star in the running worker where GENEC allows
+it (reuse_workers). Workers that fail are restarted from the last
+checkpoint of their star.
+GenecMultiple.run_queue runs the stars as a job queue, recycling the worker
+of every finished star for the next one.
+Per-worker timings of every step are recorded in GenecMultiple.metrics.
+GenecMultiple.branch starts an ensemble of stars from one stored model,
+each with its own GENEC parameter overrides.
 """
 
+import os
+import heapq
+import math
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from amuse.datamodel import Particles
 from amuse.community.genec import Genec
 from amuse.units import units
 from amuse.rfi.async_request import AsyncRequestsPool
+from amuse.support.exceptions import AmuseException
+
+from checkpoint_writer import (
+    BackgroundWriter, stop_quietly, write_checkpoint,
+)
+from genecsession import load_star, replace_star
+from worker_placement import WorkerPlacement
+from worker_metrics import WorkerMetrics
+
+
+def gather(requests):
+    "Wait for all asynchronous requests and return their results in order"
+    pool = AsyncRequestsPool()
+    for request in requests:
+        pool.add_request(request)
+    pool.waitall()
+    return [request.result() for request in requests]
 
 
 class GenecParticles:
-    def __init__(self, max_number_of_workers=4, **kwargs):
+    def __init__(
+        self, max_number_of_workers=4, multiplex=False,
+        parallel_startup=True, placement=None, reuse_workers=True, **kwargs
+    ):
         self.instances = []
         self.particles = Particles()
         self.kwargs = kwargs
         self.max_number_of_workers = max_number_of_workers
+        self.multiplex = multiplex
+        self.parallel_startup = parallel_startup
+        self.reuse_workers = reuse_workers
+        if isinstance(placement, str):
+            placement = WorkerPlacement(policy=placement)
+        self.placement = placement
+        if self.placement is not None:
+            self.placement.pin_driver()
+        # the star (in self.particles) that each instance is evolving, the
+        # star in the code and its index there, and the channel from the
+        # instance to self.particles
+        self.resident = []
+        self.stars_in_code = []
+        self.indices = []
+        self.channels = []
+        # stars that are not in a worker: internal structure by key, or the
+        # initial particle for stars that have not been started yet
+        self.parked = {}
+        self.pending = {}
+        # initial particle and last checkpoint of every star, by key
+        self.initial = {}
+        self.checkpoints = {}
+        self.steps_since_checkpoint = {}
+        self.restarts = {}
+        self.writer = None
+        # stars that are no longer evolved, with the reason, and the final
+        # internal structure of finished stars
+        self.retired = {}
+        self.final_models = {}
+        # GENEC parameter overrides by key, and the default values of the
+        # overridden parameters (for workers that get a star without them)
+        self.overrides = {}
+        self.default_parameters = {}
 
     def add_particle(self, particle):
         if len(self.instances) >= self.max_number_of_workers:
-            print("Max number of workers would be exceeded, not adding particle")
-            return
-        self.instances.append(
-            Genec(**self.kwargs)
-        )
-        self.particles.add_particle(
-            self.instances[-1].particles.add_particle(particle)
-        )
+            if not self.multiplex:
+                print(
+                    "Max number of workers would be exceeded, "
+                    "not adding particle"
+                )
+                return
+            self.initial[particle.key] = particle.copy()
+            self.pending[particle.key] = self.initial[particle.key]
+            return self.particles.add_particle(particle)
+        self.add_worker(*self.start_worker(particle, len(self.instances)))
         return self.particles[-1]
 
+    def new_instance(self, index):
+        "Start GENEC worker number index, on its own cores with placement"
+        if self.placement is None:
+            return Genec(**self.kwargs)
+        with self.placement.pinned(index):
+            return Genec(**self.kwargs)
+
+    def start_worker(self, particle, index, model=None):
+        """
+        Start GENEC worker number index and initialise particle in it, or
+        load model (an internal structure) under the key of particle
+        """
+        if model is None:
+            self.initial[particle.key] = particle.copy()
+        instance = self.new_instance(index)
+        try:
+            star_in_code = load_star(instance, model, particle, particle.key)
+            self.set_parameters(instance, particle.key, reset=model is None)
+        except BaseException:
+            stop_quietly(instance)
+            raise
+        return instance, star_in_code
+
+    def start_workers(self, particles, first_index, model=None):
+        """
+        Start workers first_index, first_index + 1, ... for particles (see
+        start_worker), concurrently unless parallel_startup is False, and
+        return their (instance, star_in_code) in order. If any of them
+        fails, the workers that did start are stopped and the error is
+        raised.
+        """
+        indices = range(first_index, first_index + len(particles))
+        started = {}
+        error = None
+        if self.parallel_startup and len(particles) > 1:
+            with ThreadPoolExecutor(max_workers=len(particles)) as executor:
+                futures = {}
+                for particle, index in zip(particles, indices):
+                    future = executor.submit(
+                        self.start_worker, particle, index, model
+                    )
+                    futures[future] = index
+                for future in as_completed(futures):
+                    try:
+                        started[futures[future]] = future.result()
+                    except BaseException as exception:
+                        if error is None:
+                            error = exception
+        else:
+            for particle, index in zip(particles, indices):
+                try:
+                    started[index] = self.start_worker(particle, index, model)
+                except BaseException as exception:
+                    error = exception
+                    break
+        if error is not None:
+            for instance, _ in started.values():
+                stop_quietly(instance)
+            raise error
+        return [started[index] for index in indices]
+
+    def set_parameters(self, instance, key, reset=True):
+        """
+        Set the parameter overrides of star key in instance, after the star
+        has been loaded (a stored model carries the parameters of its run).
+        With reset, the parameters overridden for other stars are reset to
+        their defaults; a star loaded from a model has its own already.
+        """
+        names = set().union(*self.overrides.values())
+        for name in sorted(names):
+            if name not in self.default_parameters:
+                self.default_parameters[name] = getattr(
+                    instance.parameters, name
+                )
+        overrides = self.overrides.get(key, {})
+        for name in sorted(names):
+            if name in overrides:
+                value = overrides[name]
+            elif reset:
+                value = self.default_parameters[name]
+            else:
+                continue
+            setattr(instance.parameters, name, value)
+            if getattr(instance.parameters, name) != value:
+                raise AmuseException(
+                    f"parameter {name} of star {key} could not be set to "
+                    f"{value}"
+                )
+
+    def add_worker(self, instance, star_in_code):
+        self.instances.append(instance)
+        self.particles.add_particle(star_in_code)
+        self.resident.append(self.particles[-1])
+        self.stars_in_code.append(star_in_code)
+        self.indices.append(star_in_code.index_in_code)
+        self.channels.append(instance.particles.new_channel_to(self.particles))
+
     def add_particles(self, particles):
-        number_of_new_particles = len(particles)
-        for particle in particles:
+        """
+        Add particles, starting the workers for them concurrently (unless
+        parallel_startup is False) so that startup takes about as long as
+        for a single worker.
+        """
+        number_of_particles_before = len(self.particles)
+        number_of_free_workers = max(
+            0, self.max_number_of_workers - len(self.instances)
+        )
+        starting = particles[:number_of_free_workers]
+        if self.parallel_startup and len(starting) > 1:
+            started = self.start_workers(starting, len(self.instances))
+            for instance, star_in_code in started:
+                self.add_worker(instance, star_in_code)
+        else:
+            for particle in starting:
+                self.add_particle(particle)
+        for particle in particles[number_of_free_workers:]:
             self.add_particle(particle)
-        return self.particles[-1:-(1+number_of_new_particles)]
+        return self.particles[number_of_particles_before:]
+
+    def add_particles_from_model(self, model, parameters):
+        """
+        Add a star for every dict of GENEC parameter overrides in
+        parameters, all loaded from model (an internal structure). The
+        workers are started concurrently as in add_particles; stars beyond
+        the free workers are parked (with multiplex). A failed star is
+        restarted from model until it has a checkpoint.
+        """
+        number_of_particles_before = len(self.particles)
+        stars = Particles(len(parameters))
+        for star, overrides in zip(stars, parameters):
+            self.overrides[star.key] = dict(overrides)
+            self.checkpoints[star.key] = model
+        number_of_free_workers = max(
+            0, self.max_number_of_workers - len(self.instances)
+        )
+        starting = stars[:number_of_free_workers]
+        started = self.start_workers(starting, len(self.instances), model)
+        for instance, star_in_code in started:
+            self.add_worker(instance, star_in_code)
+        for star in stars[number_of_free_workers:]:
+            if not self.multiplex:
+                print(
+                    "Max number of workers would be exceeded, "
+                    "not adding particle"
+                )
+                del self.overrides[star.key]
+                del self.checkpoints[star.key]
+                continue
+            self.parked[star.key] = model
+            self.particles.add_particle(star)
+        return self.particles[number_of_particles_before:]
+
+    def parked_stars(self):
+        "Stars that are currently not loaded in a worker, youngest first"
+        keys = set(self.parked.keys()) | set(self.pending.keys())
+        keys -= set(self.retired.keys())
+        stars = [star for star in self.particles if star.key in keys]
+        return sorted(stars, key=lambda star: star.age)
+
+    def swap(self, index, star):
+        """
+        Park the star evolved by instance `index` and load `star` in its
+        place, using the get_internal_structure / new_particle_from_model
+        round-trip.
+        """
+        old_star = self.resident[index]
+        reuse = self.retired.get(old_star.key) != "failed"
+        if old_star.key not in self.retired:
+            self.synchronise(index)
+            self.parked[old_star.key] = (
+                self.instances[index].get_internal_structure(
+                    self.indices[index]
+                )
+            )
+        self.pending.pop(star.key, None)
+        self.load(index, star, self.parked.pop(star.key, None), reuse=reuse)
+
+    def load(self, index, star, model=None, reuse=False):
+        """
+        Load star into worker number index, from model (an internal
+        structure) if given and from its initial particle otherwise; model
+        is then also its checkpoint. With reuse (and reuse_workers), the
+        star replaces the one in the running worker, otherwise (or if the
+        stopping condition of the previous star can't be cleared) a new
+        worker is started.
+        """
+        particle = self.initial[star.key] if model is None else None
+        star_in_code = None
+        if reuse and self.reuse_workers:
+            try:
+                star_in_code = replace_star(
+                    self.instances[index], self.stars_in_code[index],
+                    model, particle, star.key,
+                )
+            except (AmuseException, OSError) as error:
+                print(
+                    f"Can't replace the star in worker {index} ({error}), "
+                    "restarting workers from now on"
+                )
+                self.reuse_workers = False
+        if star_in_code is not None and not self.reset_stopping_condition(
+            index
+        ):
+            print(
+                f"Can't clear the stopping condition of worker {index}, "
+                "restarting it"
+            )
+            star_in_code = None
+        if star_in_code is None:
+            self.stop_instance(index)
+            self.instances[index] = self.new_instance(index)
+            star_in_code = load_star(
+                self.instances[index], model, particle, star.key
+            )
+        self.set_parameters(
+            self.instances[index], star.key, reset=model is None
+        )
+        if model is not None:
+            # the star's current state, so a restart goes back no further
+            self.checkpoints[star.key] = model
+            self.steps_since_checkpoint[star.key] = 0
+        self.resident[index] = star
+        self.stars_in_code[index] = star_in_code
+        self.indices[index] = star_in_code.index_in_code
+        self.channels[index] = self.instances[index].particles.new_channel_to(
+            self.particles
+        )
+        self.synchronise(index)
+
+    def reset_stopping_condition(self, index):
+        """
+        Clear the stopping condition that the previous star left in reused
+        worker index. Returns False if it can't be cleared.
+        """
+        parameters = self.instances[index].parameters
+        if parameters.stopping_condition == "none":
+            return True
+        try:
+            parameters.stopping_condition = "none"
+        except (AmuseException, AttributeError):
+            return False
+        return parameters.stopping_condition == "none"
+
+    def stop_instance(self, index):
+        "Stop worker index, which may already have died"
+        stop_quietly(self.instances[index])
+
+    def is_evolving(self, index):
+        "Whether the star in worker index is still being evolved"
+        return self.resident[index].key not in self.retired
+
+    def retire(self, index, reason):
+        "Stop evolving the star in worker index"
+        self.retired[self.resident[index].key] = reason
+
+    def finish(self, index, reason):
+        """
+        Harvest the final state of the star in worker index and stop
+        evolving it. Returns the final internal structure.
+        """
+        key = self.resident[index].key
+        self.synchronise(index)
+        model = self.instances[index].get_internal_structure(
+            self.indices[index]
+        )
+        self.final_models[key] = model
+        self.retire(index, reason)
+        return model
+
+    def checkpoint(self, index, directory=None):
+        """
+        Store the internal structure of the star in worker index in memory
+        and, if directory is given, in a pickle file there (written in the
+        background).
+        """
+        key = self.resident[index].key
+        model = self.instances[index].get_internal_structure(
+            self.indices[index]
+        )
+        self.checkpoints[key] = model
+        self.steps_since_checkpoint[key] = 0
+        if directory is not None:
+            if self.writer is None:
+                self.writer = BackgroundWriter()
+            self.writer.submit(
+                write_checkpoint,
+                model,
+                os.path.join(directory, f"star-{key}.pkl"),
+            )
+
+    def count_step(self, index, interval, directory=None):
+        "Count a completed step, and take a checkpoint every interval steps"
+        if interval is None:
+            return
+        key = self.resident[index].key
+        steps = self.steps_since_checkpoint.get(key, 0) + 1
+        self.steps_since_checkpoint[key] = steps
+        if steps >= interval:
+            self.checkpoint(index, directory)
+
+    def restart(self, index):
+        """
+        Replace worker index by a new one, restoring its star from the last
+        checkpoint (or from the initial particle if there is none).
+        """
+        star = self.resident[index]
+        self.restarts[star.key] = self.restarts.get(star.key, 0) + 1
+        self.load(index, star, self.checkpoints.get(star.key))
+        self.steps_since_checkpoint[star.key] = 0
+
+    def synchronise(self, index, attributes=None):
+        """
+        Copy the state of the star in instance index to self.particles,
+        either all attributes or only those listed in attributes.
+        """
+        if attributes is None:
+            self.channels[index].copy()
+        else:
+            self.channels[index].copy_attributes(attributes)
+
+    def placement_report(self):
+        "Cores assigned to each worker and actual affinity of the processes"
+        if self.placement is None:
+            return None
+        return self.placement.report()
 
     def __str__(self):
         return self.particles.__str__()
@@ -42,60 +434,382 @@ class GenecParticles:
 
 
 class GenecMultiple(Genec):
-    def __init__(self, max_number_of_workers=4, **kwargs):
+    def __init__(
+        self, max_number_of_workers=4, multiplex=False,
+        parallel_startup=True, placement=None, reuse_workers=True, **kwargs
+    ):
         self.kwargs = kwargs
         self.particles = GenecParticles(
             max_number_of_workers=max_number_of_workers,
+            multiplex=multiplex,
+            parallel_startup=parallel_startup,
+            placement=placement,
+            reuse_workers=reuse_workers,
             **self.kwargs
         )
         self.parameters = {
             "equal_timesteps": True,
+            # attributes copied from the workers after every step (None for
+            # all, otherwise it must include age and time_step); everything
+            # is copied at the end of evolve_model
+            "sync_attributes": (
+                "age", "mass", "radius", "luminosity", "temperature",
+                "time_step",
+            ),
+            # synchronise only stars with similar time steps, see
+            # evolve_in_groups
+            "sync_groups": False,
+            "sync_group_ratio": 4,
+            # checkpoint every star every this many steps (None for never),
+            # in memory and in checkpoint_directory if that is set; a failed
+            # worker is restarted from its checkpoint up to max_restarts
+            # times before its star is given up
+            "checkpoint_interval": None,
+            "checkpoint_directory": None,
+            "max_restarts": 3,
         }
         self.instances = self.particles.instances
         self.model_time = 0 | units.Myr
         self.max_number_of_workers = max_number_of_workers
+        self.on_finish = None
+        self.on_step = None
+        self.metrics = WorkerMetrics()
+
+    def placement_report(self):
+        return self.particles.placement_report()
+
+    def branch(self, model, variants):
+        """
+        Start an ensemble of stars from one stored model (an internal
+        structure, e.g. from a checkpoint or a TrackStore), one for every
+        dict of GENEC parameter overrides in variants, e.g.
+        [{"nzmod": 100}, {"nzmod": 200}]. The shared evolution up to model
+        isn't repeated. Returns the new stars; evolve them with
+        evolve_model or run_queue.
+        """
+        if hasattr(model, "load"):
+            model = model.load()
+        return self.particles.add_particles_from_model(model, variants)
 
     def evolve_model(self, time):
         tolerance = 1 | units.s
-        while (time - self.model_time) > tolerance:
-            print('.', end='', flush=True)
-            time_step = self.particles.particles.time_step.min()
-            time_step = min(
-                time_step,
-                time - self.model_time
+        if self.parameters['sync_groups']:
+            self.evolve_in_batches(time, tolerance, self.evolve_in_groups)
+        elif self.parameters['equal_timesteps']:
+            self.evolve_in_batches(time, tolerance, self.evolve_instances)
+        else:
+            self.evolve_event_driven(time, tolerance)
+        ages = []
+        for i in range(len(self.instances)):
+            if self.particles.is_evolving(i):
+                self.particles.synchronise(i)
+        for star in self.particles.particles:
+            if star.key not in self.particles.retired:
+                ages.append(star.age)
+        self.model_time = min(ages) if ages else time
+        print(f"\nevolved to {self.model_time.in_(units.julianyr)}")
+
+    def step_done(self, request, index):
+        """
+        Handle a finished evolve_one_step request of worker index.
+        Synchronises the star and takes a checkpoint when one is due, or
+        restarts the worker from the last checkpoint if the step failed.
+        """
+        self.metrics.step_finished(index)
+        star = self.particles.resident[index]
+        try:
+            request.result()
+        except (AmuseException, OSError) as error:
+            if (
+                self.particles.restarts.get(star.key, 0)
+                >= self.parameters['max_restarts']
+            ):
+                print(f"\nworker {index} failed ({error}), giving up star")
+                self.particles.retire(index, "failed")
+                self.particles.stop_instance(index)
+            else:
+                print(f"\nworker {index} failed ({error}), restarting")
+                self.particles.restart(index)
+            self.metrics.step_synchronised(
+                index, star.age.value_in(units.julianyr)
             )
-            if self.parameters['equal_timesteps']:
-                for instance in self.instances:
-                    instance.particles.time_step = time_step
+            return
+        time_start = perf_counter()
+        self.particles.synchronise(index, self.parameters['sync_attributes'])
+        self.metrics.add_rpc(index, perf_counter() - time_start)
+        self.metrics.step_synchronised(
+            index, star.age.value_in(units.julianyr)
+        )
+        self.particles.count_step(
+            index,
+            self.parameters['checkpoint_interval'],
+            self.parameters['checkpoint_directory'],
+        )
+        if self.on_step is not None:
+            # the callback gets all attributes, not only sync_attributes
+            time_start = perf_counter()
+            self.particles.synchronise(index)
+            self.metrics.add_rpc(index, perf_counter() - time_start)
+            self.on_step(star)
+
+    def dispatch(self, index, pool, handler):
+        "Start a step of worker index, to be handled by handler"
+        star = self.particles.resident[index]
+        self.metrics.step_started(
+            index, star.key, star.age.value_in(units.julianyr)
+        )
+        pool.add_request(
+            self.instances[index].evolve_one_step(
+                self.particles.indices[index], return_request=True
+            ),
+            handler,
+            [index],
+        )
+
+    def evolve_in_batches(self, time, tolerance, evolve):
+        """
+        Evolve all stars to time, using evolve(time, tolerance) for the
+        stars that are loaded in a worker and swapping in parked stars
+        when those are done
+        """
+        evolve(time, tolerance)
+        while self.particles.multiplex:
+            # Evolve the parked stars in batches, youngest first
+            waiting = [
+                star for star in self.particles.parked_stars()
+                if (time - star.age) > tolerance
+            ]
+            if not waiting:
+                break
+            for i, star in enumerate(waiting[:len(self.instances)]):
+                self.particles.swap(i, star)
+            evolve(time, tolerance)
+
+    def run_queue(self, end_time, on_finish=None, on_step=None):
+        """
+        Run the stars as a job queue: evolve each star until end_time or
+        until GENEC reports a stopping condition, then harvest its final
+        state (see GenecParticles.final_models), call
+        on_finish(star, model) and start the next waiting star in the same
+        worker. Workers are stopped when the queue is empty. Use
+        multiplex=True to queue more stars than there are workers.
+        on_step(star) is called after every step of a star, with all
+        attributes of the star synchronised.
+        """
+        self.on_finish = on_finish
+        self.on_step = on_step
+        self.evolve_event_driven(end_time, finish=True)
+        self.on_finish = None
+        self.on_step = None
+        print(f"\nfinished {len(self.particles.final_models)} stars")
+
+    def finish(self, index, reason):
+        "Harvest the star in worker index and call the on_finish callback"
+        model = self.particles.finish(index, reason)
+        if self.on_finish is not None:
+            self.on_finish(self.particles.resident[index], model)
+
+    def evolve_event_driven(self, time, tolerance=1 | units.s, finish=False):
+        """
+        Evolve all stars to time without a global barrier. Each worker gets
+        its next step as soon as its previous one has completed, and a
+        worker whose star has reached time takes the youngest waiting star
+        from a priority queue. With finish=True (job-queue mode), stars are
+        finished when they reach time or a stopping condition, and idle
+        workers are stopped.
+        """
+        waiting = []
+        for number, star in enumerate(self.particles.parked_stars()):
+            if (time - star.age) > tolerance:
+                heapq.heappush(
+                    waiting,
+                    (star.age.value_in(units.julianyr), number, star)
+                )
+        idle = list(range(len(self.instances)))
+        pool = AsyncRequestsPool()
+
+        def step_done(request, index):
+            self.step_done(request, index)
+            if finish and self.particles.is_evolving(index):
+                instance = self.instances[index]
+                condition = instance.parameters.stopping_condition
+                if condition != "none":
+                    self.finish(index, condition)
+            idle.append(index)
+            print('.', end='', flush=True)
+
+        while True:
+            while idle:
+                index = idle.pop()
+                star = self.particles.resident[index]
+                if (
+                    (time - star.age) <= tolerance
+                    or not self.particles.is_evolving(index)
+                ):
+                    if finish and self.particles.is_evolving(index):
+                        self.finish(index, "end time")
+                    if not waiting:
+                        if finish:
+                            self.particles.stop_instance(index)
+                        continue
+                    star = heapq.heappop(waiting)[2]
+                    self.particles.swap(index, star)
+                if (star.age + star.time_step) > time:
+                    self.set_time_steps([index], [time - star.age])
+                self.dispatch(index, pool, step_done)
+            if len(pool) == 0:
+                break
+            pool.wait()
+
+    def evolve_instances(self, time, tolerance=1 | units.s):
+        """
+        Evolve the stars that are currently loaded in a worker to time.
+        Ages and time steps are taken from self.particles, which step_done
+        synchronises after every step.
+        """
+        stars = self.particles.resident
+        while True:
+            active = [
+                i for i in range(len(self.instances))
+                if self.particles.is_evolving(i)
+            ]
+            if not active:
+                break
+            ages = [stars[i].age for i in active]
+            time_steps = [stars[i].time_step for i in active]
+            if (time - min(ages)) <= tolerance:
+                break
+            print('.', end='', flush=True)
+            common_time_step = min(min(time_steps), time - min(ages))
+            stepping = []
+            indices = []
+            new_time_steps = []
+            for i, age, time_step in zip(active, ages, time_steps):
+                if (time - age) <= tolerance:
+                    continue
+                stepping.append(i)
+                new_time_step = time_step
+                if self.parameters['equal_timesteps']:
+                    new_time_step = common_time_step
+                if (age + new_time_step) > time:
+                    new_time_step = time - age
+                if new_time_step != time_step:
+                    indices.append(i)
+                    new_time_steps.append(new_time_step)
+            self.set_time_steps(indices, new_time_steps)
             pool = AsyncRequestsPool()
-            for i, instance in enumerate(self.instances):
-                age = instance.particles[0].age.in_(units.julianyr)
-                time_step = instance.particles[0].time_step.in_(units.julianyr)
-                if (time - age) > tolerance:
-                    if (age + time_step) > time:
-                        new_time_step = (time - age).in_(units.julianyr)
-                        instance.particles.time_step = new_time_step
-                        print(f"instance {i} setting new time step to {new_time_step}")
-                    print(f"{instance.state_machine.get_name_of_current_state()}")
-                    
-                    print(f"{i}: {time-age} to go, step is {time_step}")
-                    pool.join(
-                        instance.evolve_one_step(0, return_request=True)
-                    )
+            for i in stepping:
+                self.dispatch(i, pool, self.step_done)
             pool.waitall()
-            self.model_time = 1e99 | units.julianyr
-            for instance in self.instances:
-                channel = instance.particles.new_channel_to(self.particles.particles)
-                channel.copy()
-                self.model_time = min(instance.particles.age.min(), self.model_time)
-        print(f"\nevolved to {self.model_time.in_(units.julianyr)}")
+
+    def evolve_in_groups(self, time, tolerance=1 | units.s):
+        """
+        Evolve the stars that are loaded in a worker to time, synchronising
+        only stars with a similar time step.
+        Stars are grouped by time step in factors of sync_group_ratio, and
+        the stars in group g all step with dt_min * sync_group_ratio**g
+        (dt_min being the shortest time step). The groups are therefore
+        commensurate and meet again after one step of the slowest group,
+        where new groups are made. Within that interval each worker is
+        re-dispatched as soon as its step completes.
+        """
+        ratio = self.parameters['sync_group_ratio']
+        stars = self.particles.resident
+        pool = AsyncRequestsPool()
+        idle = []
+
+        def step_done(request, index):
+            self.step_done(request, index)
+            idle.append(index)
+            print('.', end='', flush=True)
+
+        while True:
+            active = [
+                i for i in range(len(stars)) if self.particles.is_evolving(i)
+            ]
+            if (
+                not active
+                or (time - min(stars[i].age for i in active)) <= tolerance
+            ):
+                break
+            time_steps = {
+                i: stars[i].time_step.value_in(units.julianyr) for i in active
+            }
+            shortest = min(time_steps.values())
+            group_time_steps = {
+                i: shortest * ratio**math.floor(
+                    math.log(time_step / shortest, ratio) + 1e-9
+                ) | units.julianyr
+                for i, time_step in time_steps.items()
+            }
+            sync_time = min(
+                min(stars[i].age for i in active)
+                + max(group_time_steps.values()),
+                time,
+            )
+            idle.extend(active)
+            while True:
+                while idle:
+                    index = idle.pop()
+                    star = stars[index]
+                    if (
+                        (sync_time - star.age) <= tolerance
+                        or not self.particles.is_evolving(index)
+                    ):
+                        continue
+                    time_step = min(
+                        group_time_steps[index], sync_time - star.age
+                    )
+                    if time_step < star.time_step:
+                        self.set_time_steps([index], [time_step])
+                    self.dispatch(index, pool, step_done)
+                if len(pool) == 0:
+                    break
+                pool.wait()
+
+    def get_state(self, *names, indices=None):
+        """
+        Get scalar properties (e.g. "age", "time_step") of the stars in the
+        workers with the given indices (default: all), with one round of
+        asynchronous requests. Returns one list per name, ordered like
+        indices.
+        """
+        if indices is None:
+            indices = range(len(self.instances))
+        time_start = perf_counter()
+        requests = [
+            getattr(self.instances[i], "get_" + name)(
+                self.particles.indices[i], return_request=True
+            )
+            for name in names
+            for i in indices
+        ]
+        results = gather(requests)
+        self.metrics.add_batch_rpc(indices, perf_counter() - time_start)
+        number_of_instances = len(indices)
+        return [
+            results[i*number_of_instances:(i+1)*number_of_instances]
+            for i in range(len(names))
+        ]
+
+    def set_time_steps(self, indices, time_steps):
+        "Set the time steps of the stars in workers indices concurrently"
+        time_start = perf_counter()
+        gather([
+            self.instances[i].set_time_step(
+                self.particles.indices[i], time_step, return_request=True
+            )
+            for i, time_step in zip(indices, time_steps)
+        ])
+        self.metrics.add_batch_rpc(indices, perf_counter() - time_start)
 
     def evolve_for(self, time):
-        for instance in self.instances:
-            instance.evolve_for(0, time)
+        for i, instance in enumerate(self.instances):
+            instance.evolve_for(self.particles.indices[i], time)
 
     def evolve_one_step(self):
-        for instance in self.instances:
-            instance.evolve_one_step(0)
-            channel = instance.particles.new_channel_to(self.particles.particles)
-            channel.copy()
+        for i, instance in enumerate(self.instances):
+            if not self.particles.is_evolving(i):
+                continue
+            instance.evolve_one_step(self.particles.indices[i])
+            self.particles.synchronise(i)
@@ -0,0 +1,103 @@
+"""
+Persistent GENEC worker sessions.
+Starting a GENEC worker costs a process spawn and initialisation, so a
+session keeps one worker running and loads each new model into it,
+replacing the star that was there. If the worker can't replace its star,
+it is restarted instead, and the session stops trying to reuse it.
+Loading the model that get_internal_structure just returned (the same
+dict) keeps the star in the worker, which already has that state, so a
+run in chunks costs the same as a continuous one.
+
+    with GenecSession(redirection="none") as session:
+        session.load(model)
+        session.evolve(100)
+        model = session.get_internal_structure()
+"""
+from amuse.community.genec import Genec
+from amuse.support.exceptions import AmuseException
+
+
+def load_star(instance, model=None, particle=None, key=None):
+    """
+    Add a star to instance, from model (an internal structure) or from
+    particle. Returns the star in the code.
+    """
+    if model is None:
+        return instance.particles.add_particle(particle)
+    instance.new_particle_from_model(model, key=key)
+    return instance.particles[-1]
+
+
+def replace_star(instance, star_in_code, model=None, particle=None, key=None):
+    "Remove star_in_code from instance and load a new star in its place"
+    instance.particles.remove_particle(star_in_code)
+    return load_star(instance, model, particle, key)
+
+
+class GenecSession:
+    def __init__(self, reuse=True, **kwargs):
+        self.kwargs = kwargs
+        self.reuse = reuse
+        self.instance = None
+        self.star = None
+        # the model last returned by get_internal_structure, while it is
+        # still the state of self.star
+        self.model = None
+        self.number_of_starts = 0
+
+    def start(self):
+        "(Re)start the worker"
+        self.stop()
+        self.instance = Genec(**self.kwargs)
+        self.number_of_starts += 1
+
+    def load(self, model=None, particle=None, key=None):
+        """
+        Load a star from model (an internal structure) or from particle,
+        replacing the current one. Returns the star in the code.
+        """
+        if model is not None and model is self.model:
+            return self.star
+        self.model = None
+        if self.reuse and self.star is not None:
+            try:
+                self.star = replace_star(
+                    self.instance, self.star, model, particle, key
+                )
+                return self.star
+            except (AmuseException, OSError) as error:
+                print(
+                    f"Can't replace the star in the GENEC worker ({error}), "
+                    "restarting workers from now on"
+                )
+                self.reuse = False
+        if self.instance is None or self.star is not None:
+            self.start()
+        self.star = load_star(self.instance, model, particle, key)
+        return self.star
+
+    def evolve(self, number_of_steps):
+        self.model = None
+        for i in range(number_of_steps):
+            self.star.evolve_one_step()
+
+    def get_internal_structure(self):
+        self.model = self.star.get_internal_structure()
+        return self.model
+
+    def stop(self):
+        if self.instance is None:
+            return
+        try:
+            self.instance.stop()
+        except (AmuseException, OSError):
+            pass
+        self.instance = None
+        self.star = None
+        self.model = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.stop()
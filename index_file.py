@@ -0,0 +1,34 @@
+"""
+Fixed-size index records of append-only files (track_store,
+abundance_archive). Every record has the offset of its item in the data
+file, and items are written before their record, so a crash or a full disk
+can leave a partly written last record, or records of items that are
+incomplete. load_index drops both, so that appending continues at the
+right place.
+"""
+import os
+
+import numpy
+
+
+def load_index(index_filename, dtype, data_filename, nbytes):
+    """
+    The records (of dtype, with an offset field) in index_filename whose
+    items are complete in data_filename; nbytes(records) is the size of
+    their items. The index file is cut back to those records.
+    """
+    if not os.path.exists(index_filename):
+        return numpy.zeros(0, dtype=dtype)
+    size = os.path.getsize(index_filename)
+    if size % dtype.itemsize:
+        os.truncate(index_filename, size - size % dtype.itemsize)
+    index = numpy.fromfile(index_filename, dtype=dtype)
+    data_size = (
+        os.path.getsize(data_filename)
+        if os.path.exists(data_filename) else 0
+    )
+    complete = index["offset"] + nbytes(index) <= data_size
+    if not complete.all():
+        index = index[complete]
+        index.tofile(index_filename)
+    return index
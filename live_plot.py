@@ -0,0 +1,109 @@
+"""
+Live plots in a separate process.
+StellarModelPlot redraws its figures in the evolution loop, which then
+waits for matplotlib. LivePlot runs it in another process instead, fed
+with ProfileSnapshots through a queue:
+
+    live_plot = LivePlot()
+    ...
+        live_plot.update(ProfileSnapshot(star_in_code), step)
+    ...
+    live_plot.close()
+
+Snapshots are collected until the plotter is ready for more, and then sent
+together: the plotter adds all of them to its history, but only draws the
+last one, so frames are dropped when it falls behind. Only the snapshot
+that is drawn needs all profiles (fetched just before sending it); the
+others are kept as reduced snapshots, with only their central abundances.
+When more than max_pending snapshots are waiting, the oldest are dropped.
+"""
+import time
+import queue
+import multiprocessing
+
+from profile_snapshot import PLOT_PROFILES
+
+
+def run_plotter(snapshots, ready):
+    "Draw the snapshots that arrive in the snapshots queue, until None"
+    import matplotlib.pyplot as plt
+    from amuse.units import units
+    from plot_models import StellarModelPlot
+
+    plt.rc('font', size=8)
+    plt.ion()
+    plotting = None
+    time_of_last_plot = time.time()
+    age_of_last_plot = None
+    ready.set()
+    while True:
+        try:
+            item = snapshots.get(timeout=0.1)
+        except queue.Empty:
+            if plotting is not None:
+                # keep the windows responsive
+                plt.pause(0.1)
+            continue
+        if item is None:
+            return
+        batch, step = item
+        star = batch[-1]
+        if plotting is None:
+            # draws the first frame
+            plotting = StellarModelPlot(star)
+        else:
+            for snapshot in batch:
+                plotting.update(snapshot)
+            now = time.time()
+            speed = (
+                (star.age - age_of_last_plot).value_in(units.Myr)
+                / ((now - time_of_last_plot) / 60)
+            ) | units.Myr / units.minute
+            plotting.plot_all(speed=speed, step=step)
+        time_of_last_plot = time.time()
+        age_of_last_plot = star.age
+        ready.set()
+
+
+class LivePlot:
+    def __init__(self, max_pending=100):
+        # spawn, so the plotter doesn't inherit the GENEC worker connection
+        context = multiprocessing.get_context("spawn")
+        self.snapshots = context.Queue(maxsize=1)
+        self.ready = context.Event()
+        self.process = context.Process(
+            target=run_plotter, args=(self.snapshots, self.ready),
+            daemon=True,
+        )
+        self.process.start()
+        self.max_pending = max_pending
+        self.pending = []
+        self.dropped = 0
+
+    def update(self, snapshot, step=None):
+        """
+        Add snapshot (a ProfileSnapshot) of step; it is sent to the plotter
+        right away if that is ready, and drawn
+        """
+        if not self.ready.is_set() or not self.process.is_alive():
+            self.pending.append(snapshot.reduced())
+            if len(self.pending) > self.max_pending:
+                del self.pending[0]
+                self.dropped += 1
+            return
+        self.ready.clear()
+        for name in PLOT_PROFILES:
+            snapshot.profile(name)
+        self.snapshots.put((self.pending + [snapshot], step))
+        self.pending = []
+
+    def close(self, timeout=5):
+        "Stop the plotter, closing its windows"
+        if self.process.is_alive():
+            try:
+                self.snapshots.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
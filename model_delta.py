@@ -0,0 +1,98 @@
+"""
+Exact deltas between consecutive GENEC models.
+
+make_delta(previous, model) returns a dict with only what changed: changed
+scalars and arrays with a new shape are stored in full, arrays in which few
+elements changed as the indices and new values of those elements, and
+other arrays as the XOR of their bits with the previous model (mostly zero
+bits for small changes, so it compresses well). apply_delta(previous,
+delta) reconstructs model exactly, bit for bit.
+"""
+import numpy
+
+DELTA_BASE = "__delta_base__"
+FIELDS = "__fields__"
+# store changed elements by index if fewer than this fraction changed
+SPARSE_FRACTION = 0.25
+
+
+def _bits(array):
+    "Array reinterpreted as unsigned integers, or None if it can't be"
+    if array.dtype.kind not in "fiub" or array.dtype.itemsize not in (
+        1, 2, 4, 8
+    ):
+        return None
+    return numpy.ascontiguousarray(array).view(
+        f"<u{array.dtype.itemsize}"
+    ).reshape(-1)
+
+
+def _equal(old, new):
+    if type(old) is not type(new):
+        return False
+    try:
+        return bool(old == new)
+    except (TypeError, ValueError):
+        return False
+
+
+def is_delta(model):
+    return DELTA_BASE in model
+
+
+def make_delta(previous, model, base=None):
+    """
+    The delta from previous to model (both dicts). base is stored in the
+    delta to identify previous, e.g. its model number.
+    """
+    delta = {DELTA_BASE: base, FIELDS: list(model.keys())}
+    for name, value in model.items():
+        if name not in previous:
+            delta[name] = value
+            continue
+        old = previous[name]
+        if not (
+            isinstance(value, numpy.ndarray)
+            and isinstance(old, numpy.ndarray)
+            and value.shape == old.shape
+            and value.dtype == old.dtype
+        ):
+            if not _equal(old, value):
+                delta[name] = value
+            continue
+        new_bits = _bits(value)
+        old_bits = _bits(old)
+        if new_bits is None:
+            if not numpy.array_equal(old, value):
+                delta[name] = value
+            continue
+        changed = numpy.flatnonzero(new_bits != old_bits)
+        if changed.size == 0:
+            continue
+        if changed.size < SPARSE_FRACTION * value.size:
+            delta[name + "@indices"] = changed
+            delta[name + "@values"] = value.reshape(-1)[changed]
+        else:
+            delta[name + "@xor"] = numpy.bitwise_xor(new_bits, old_bits)
+    return delta
+
+
+def apply_delta(previous, delta):
+    "Reconstruct a model from the previous model and the delta to it"
+    model = {}
+    for name in delta[FIELDS]:
+        if name in delta:
+            model[name] = delta[name]
+        elif name + "@indices" in delta:
+            array = numpy.array(previous[name])
+            array.reshape(-1)[delta[name + "@indices"]] = (
+                delta[name + "@values"]
+            )
+            model[name] = array
+        elif name + "@xor" in delta:
+            old = previous[name]
+            bits = numpy.bitwise_xor(_bits(old), delta[name + "@xor"])
+            model[name] = bits.view(old.dtype).reshape(old.shape)
+        else:
+            model[name] = previous[name]
+    return model
@@ -0,0 +1,270 @@
+"""
+Compact columnar file format for GENEC internal-structure models, as
+returned by get_internal_structure().
+
+A model file has a short preamble, a JSON header with the scalar fields and
+a table of the array fields, and then the arrays, each aligned so that it
+can be memory-mapped. Arrays can optionally be stored as float32 (lossy)
+and/or zlib-compressed (then they are decompressed on access instead of
+memory-mapped). Fields that are neither scalars nor numerical arrays are
+stored pickled.
+
+    write_model(model, "star.gmod")
+    model = read_model("star.gmod")     # lazy, arrays are read on access
+    instance.new_particle_from_model(model.load())
+
+Run `python model_format.py benchmark model.pkl` to compare with pickle.
+"""
+import sys
+import json
+import time
+import zlib
+import pickle
+import struct
+from collections.abc import Mapping
+
+import numpy
+
+MAGIC = b"GENECMDL"
+VERSION = 1
+ALIGNMENT = 64
+PREAMBLE = struct.Struct("<8sIQ")
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _list_array(value):
+    """
+    value (a list) as an array, or None if it doesn't come back unchanged
+    from one (mixed types, ragged lists, tuples inside)
+    """
+    try:
+        array = numpy.asarray(value)
+    except ValueError:
+        return None
+    if array.dtype.hasobject or repr(array.tolist()) != repr(value):
+        return None
+    return array
+
+
+def encode_model(model, float32=False, compress=False, level=6):
+    """
+    Encode a model (dict) to bytes. float32=True stores float64 arrays as
+    float32, compress=True compresses the arrays with zlib.
+    """
+    header = {"fields": list(model.keys()), "scalars": {}, "arrays": {}}
+    blobs = []
+    offset = 0
+    for name, value in model.items():
+        if isinstance(value, numpy.generic):
+            value = value.item()
+        if value is None or isinstance(value, (bool, int, float, str)):
+            header["scalars"][name] = value
+            continue
+        kind = "array"
+        array = None
+        if isinstance(value, list):
+            array = _list_array(value)
+            kind = "list" if array is not None else "pickle"
+        elif isinstance(value, numpy.ndarray):
+            array = value
+        if array is None or array.dtype.hasobject:
+            kind = "pickle"
+            array = numpy.frombuffer(pickle.dumps(value), dtype=numpy.uint8)
+        stored = array
+        if float32 and array.dtype == numpy.float64:
+            stored = array.astype(numpy.float32)
+        data = numpy.ascontiguousarray(stored).tobytes()
+        if compress:
+            data = zlib.compress(data, level)
+        offset = _aligned(offset)
+        header["arrays"][name] = {
+            "kind": kind,
+            "dtype": array.dtype.str,
+            "stored_dtype": stored.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+            "nbytes": len(data),
+            "compression": "zlib" if compress else None,
+        }
+        blobs.append((offset, data))
+        offset += len(data)
+
+    header_bytes = json.dumps(header).encode()
+    data_start = _aligned(PREAMBLE.size + len(header_bytes))
+    buffer = bytearray(data_start + offset)
+    PREAMBLE.pack_into(buffer, 0, MAGIC, VERSION, len(header_bytes))
+    buffer[PREAMBLE.size:PREAMBLE.size + len(header_bytes)] = header_bytes
+    for blob_offset, data in blobs:
+        start = data_start + blob_offset
+        buffer[start:start + len(data)] = data
+    return bytes(buffer)
+
+
+def write_model(model, filename, float32=False, compress=False):
+    "Write a model (dict) to filename"
+    with open(filename, "wb") as outstream:
+        outstream.write(
+            encode_model(model, float32=float32, compress=compress)
+        )
+
+
+def read_header(instream, offset=0):
+    "Read the header of the model at offset, returns (header, data_start)"
+    instream.seek(offset)
+    magic, version, header_size = PREAMBLE.unpack(
+        instream.read(PREAMBLE.size)
+    )
+    if magic != MAGIC:
+        raise ValueError("not a GENEC model")
+    if version > VERSION:
+        raise ValueError(f"unsupported GENEC model version {version}")
+    header = json.loads(instream.read(header_size))
+    return header, offset + _aligned(PREAMBLE.size + header_size)
+
+
+class LazyModel(Mapping):
+    """
+    A model in a file (at offset, for files with more than one model).
+    Scalars are read with the header; arrays are memory-mapped (or read and
+    decompressed) when they are first accessed.
+    """
+    def __init__(self, filename, offset=0):
+        self.filename = filename
+        with open(filename, "rb") as instream:
+            self.header, self.__data_start = read_header(instream, offset)
+        self.__arrays = {}
+
+    @property
+    def scalars(self):
+        "The scalar fields, without reading any arrays"
+        return self.header["scalars"]
+
+    def __getitem__(self, name):
+        if name in self.header["scalars"]:
+            return self.header["scalars"][name]
+        if name not in self.__arrays:
+            self.__arrays[name] = self.__read_array(
+                self.header["arrays"][name]
+            )
+        return self.__arrays[name]
+
+    def __read_array(self, entry):
+        offset = self.__data_start + entry["offset"]
+        shape = tuple(entry["shape"])
+        stored_dtype = numpy.dtype(entry["stored_dtype"])
+        if entry["compression"] is None:
+            if entry["nbytes"] == 0:
+                array = numpy.zeros(shape, dtype=stored_dtype)
+            else:
+                array = numpy.memmap(
+                    self.filename, dtype=stored_dtype, mode="r",
+                    offset=offset, shape=shape,
+                )
+        else:
+            with open(self.filename, "rb") as instream:
+                instream.seek(offset)
+                data = zlib.decompress(instream.read(entry["nbytes"]))
+            array = numpy.frombuffer(data, dtype=stored_dtype).reshape(shape)
+        if entry["kind"] == "pickle":
+            return pickle.loads(array.tobytes())
+        if stored_dtype != numpy.dtype(entry["dtype"]):
+            array = array.astype(entry["dtype"])
+        if entry["kind"] == "list":
+            return array.tolist()
+        return array
+
+    def __iter__(self):
+        return iter(self.header["fields"])
+
+    def __len__(self):
+        return len(self.header["fields"])
+
+    def load(self):
+        "Read all fields into a plain dict, e.g. for new_particle_from_model"
+        model = {}
+        for name in self:
+            value = self[name]
+            if isinstance(value, numpy.memmap):
+                value = numpy.array(value)
+            model[name] = value
+        return model
+
+
+def read_model(filename, offset=0):
+    "Open a model file lazily"
+    return LazyModel(filename, offset)
+
+
+def benchmark(model, filename="benchmark", repeat=5):
+    """
+    Compare writing, reading and reading one field of a model with pickle
+    and with this format (plain, float32 and compressed). Prints and
+    returns {method: (size, write time, read time, field time)}.
+    """
+    field = next(
+        (name for name, value in model.items()
+         if isinstance(value, numpy.ndarray)),
+        next(iter(model)),
+    )
+
+    def timed(function):
+        time_start = time.perf_counter()
+        for i in range(repeat):
+            result = function()
+        return (time.perf_counter() - time_start) / repeat, result
+
+    def write_pickle():
+        with open(filename + ".pkl", "wb") as outstream:
+            pickle.dump(model, outstream)
+
+    def read_pickle():
+        with open(filename + ".pkl", "rb") as instream:
+            return pickle.load(instream)
+
+    results = {}
+    write_time, _ = timed(write_pickle)
+    read_time, _ = timed(read_pickle)
+    field_time, _ = timed(lambda: read_pickle()[field])
+    with open(filename + ".pkl", "rb") as instream:
+        size = len(instream.read())
+    results["pickle"] = (size, write_time, read_time, field_time)
+    for method, options in (
+        ("columnar", {}),
+        ("columnar float32", {"float32": True}),
+        ("columnar zlib", {"compress": True}),
+    ):
+        name = filename + ".gmod"
+        write_time, _ = timed(lambda: write_model(model, name, **options))
+        read_time, _ = timed(lambda: read_model(name).load())
+        field_time, _ = timed(lambda: numpy.asarray(read_model(name)[field]))
+        with open(name, "rb") as instream:
+            size = len(instream.read())
+        results[method] = (size, write_time, read_time, field_time)
+
+    print(f"{'method':18s} {'bytes':>10s} {'write':>9s} {'read':>9s} "
+          f"{'field':>9s}")
+    for method, (size, write_time, read_time, field_time) in results.items():
+        print(
+            f"{method:18s} {size:10d} {write_time*1e3:7.2f}ms "
+            f"{read_time*1e3:7.2f}ms {field_time*1e3:7.2f}ms"
+        )
+    return results
+
+
+def main():
+    "Convert (convert files...) or benchmark (benchmark files...) pickles"
+    command = sys.argv[1]
+    for filename in sys.argv[2:]:
+        with open(filename, "rb") as instream:
+            model = pickle.load(instream)
+        if command == "convert":
+            write_model(model, filename.rsplit(".", 1)[0] + ".gmod")
+        elif command == "benchmark":
+            benchmark(model)
+
+
+if __name__ == "__main__":
+    main()
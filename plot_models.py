@@ -7,6 +7,11 @@ from amuse.units import units
 
 
 class StellarModelPlot:
+    """
+    Live plots of the evolution and structure of star, which can be a star
+    in the code or a ProfileSnapshot of it (then every profile is fetched
+    only once per step). Profiles are not changed in place.
+    """
     def __init__(self, star):
         self.default_units = {
             'temperature': units.K,
@@ -491,10 +496,10 @@ class StellarModelPlot:
             )
         )
 
-        eps = self.star.get_eps_profile()
+        eps = self.star.get_eps_profile().copy()
         eps[eps <= 0.] = 1e-32
         eps_H_log = np.log10(eps)
-        epsy = self.star.get_epsy_profile()
+        epsy = self.star.get_epsy_profile().copy()
         epsy[epsy <= 0.] = 1e-32
         eps_He_log = np.log10(epsy)
         max_eps = max(max(eps_H_log), max(eps_He_log))
@@ -550,10 +555,10 @@ class StellarModelPlot:
                 max(luminosity_profile)+0.1,
             )
         )
-        eps = self.star.get_eps_profile()
+        eps = self.star.get_eps_profile().copy()
         eps[eps <= 0.] = 1e-32
         eps_H_log = np.log10(eps)
-        epsy = self.star.get_epsy_profile()
+        epsy = self.star.get_epsy_profile().copy()
         epsy[epsy <= 0.] = 1e-32
         eps_He_log = np.log10(epsy)
         max_eps = max(max(eps_H_log), max(eps_He_log))
@@ -0,0 +1,102 @@
+"""
+Snapshot of a star in GENEC, with its profiles.
+Every get_*_profile() of a star in a code is a call to the worker, and the
+driver, the backup and the plots each need the same profiles, so a
+snapshot fetches each profile only once and keeps it until it is replaced
+by the snapshot of the next step. It can be used instead of the star:
+
+    star = ProfileSnapshot(star_in_code)
+    print(star.age, star.mass)
+    abundances = star.get_chemical_abundance_profiles()
+    plotting.update(star)
+
+Profiles listed in profiles are fetched right away, others when they are
+first needed, which is only possible while the star in the code is still
+at the age of the snapshot (so profiles of different steps are never
+mixed); otherwise a KeyError is raised. A snapshot
+can be pickled, e.g. to send it to another process, and then only has the
+profiles that were fetched before. A reduced snapshot only has the
+central abundances, which is all a plot needs of a frame it doesn't draw.
+"""
+import copy
+
+import numpy
+
+# name of every profile, and the method of the star that returns it
+PROFILE_GETTERS = {
+    "cumulative_mass": "get_cumulative_mass_profile",
+    "chemical_abundance": "get_chemical_abundance_profiles",
+    "luminosity": "get_luminosity_profile",
+    "temperature": "get_temperature_profile",
+    "pressure": "get_pressure_profile",
+    "nabla_rad": "get_nabla_rad_profile",
+    "nabla_ad": "get_nabla_ad_profile",
+    "nabla_mu": "get_nabla_mu_profile",
+    "eps": "get_eps_profile",
+    "epsy": "get_epsy_profile",
+}
+PROFILE_NAMES = {getter: name for name, getter in PROFILE_GETTERS.items()}
+# the profiles used by StellarModelPlot
+PLOT_PROFILES = tuple(PROFILE_GETTERS.keys())
+
+
+class ProfileSnapshot:
+    def __init__(self, star, profiles=PLOT_PROFILES):
+        self.__star = star
+        self.particle = star.copy()
+        self.__age = self.particle.age
+        self.phase = star.get_phase()
+        self.species = list(star.get_names_of_species())
+        self.profiles = {}
+        for name in profiles:
+            self.profile(name)
+
+    def profile(self, name):
+        "The profile called name (see PROFILE_GETTERS)"
+        if name not in self.profiles:
+            if self.__star is None:
+                raise KeyError(f"profile {name} is not in the snapshot")
+            if self.__star.age != self.__age:
+                raise KeyError(
+                    f"profile {name} is not in the snapshot, and the star "
+                    "has evolved since"
+                )
+            self.profiles[name] = getattr(
+                self.__star, PROFILE_GETTERS[name]
+            )()
+        return self.profiles[name]
+
+    def reduced(self):
+        """
+        A copy with the state of the star and only the central abundances
+        (the chemical_abundance profile of the innermost zone); other
+        profiles can't be fetched from it
+        """
+        snapshot = copy.copy(self)
+        snapshot.__star = None
+        snapshot.profiles = {
+            "chemical_abundance": numpy.array(
+                self.profile("chemical_abundance")[:, :1]
+            ),
+        }
+        return snapshot
+
+    def get_phase(self):
+        return self.phase
+
+    def get_names_of_species(self):
+        return self.species
+
+    def __getattr__(self, name):
+        # the profile getters of the star, and the attributes of the star at
+        # the time of the snapshot (age, mass, key, as_set, ...)
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in PROFILE_NAMES:
+            return lambda: self.profile(PROFILE_NAMES[name])
+        return getattr(self.particle, name)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_ProfileSnapshot__star"] = None
+        return state
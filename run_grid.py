@@ -0,0 +1,198 @@
+"""
+Run a grid of GENEC stars (mass x metallicity x zams_velocity) through a
+pool of GENEC workers, using GenecMultiple in job-queue mode.
+Writes one track per star, and skips the stars that have finished when
+the grid is run again.
+
+    python run_grid.py --age 100 --mass 7 8 9 --metallicity 0.014 \\
+        --zams-velocity 0 0.4 --workers 8 --output grid
+    python run_grid.py --age 100 --grid grid.json --workers 8
+
+A grid file is a JSON dict with lists for "mass" (MSun), "metallicity"
+and "zams_velocity".
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import itertools
+
+from amuse.units import units
+from amuse.datamodel import Particle, Particles
+
+from genecmultiple import GenecMultiple
+from checkpoint_writer import BackgroundWriter
+from timeline_writer import TimelineWriter
+
+
+def new_argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--age", type=float, required=True,
+        help="final age in Myr (stars also stop at a stopping condition)",
+    )
+    parser.add_argument("--grid", help="JSON file with the grid")
+    parser.add_argument("--mass", type=float, nargs="+", default=[7.0])
+    parser.add_argument(
+        "--metallicity", type=float, nargs="+", default=[0.014]
+    )
+    parser.add_argument(
+        "--zams-velocity", type=float, nargs="+", default=[0.0]
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--output", default="grid")
+    parser.add_argument(
+        "--checkpoint-interval", type=int, default=None,
+        help="checkpoint every star every this many steps",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    return parser
+
+
+def grid_points(grid):
+    "All combinations of the grid values, as dicts"
+    return [
+        {"mass": mass, "metallicity": metallicity, "zams_velocity": velocity}
+        for mass, metallicity, velocity in itertools.product(
+            grid["mass"], grid["metallicity"], grid["zams_velocity"]
+        )
+    ]
+
+
+def star_name(point):
+    return (
+        f"M{point['mass']:g}-Z{point['metallicity']:g}"
+        f"-V{point['zams_velocity']:g}"
+    )
+
+
+def track_filename(output, name):
+    return os.path.join(output, f"{name}.amuse")
+
+
+def done_filename(output, name):
+    return os.path.join(output, f"{name}.done")
+
+
+def final_model_filename(output, name):
+    return os.path.join(output, f"{name}-final.pkl")
+
+
+def main():
+    args = new_argument_parser().parse_args()
+    if args.grid is not None:
+        with open(args.grid) as infile:
+            grid = json.load(infile)
+    else:
+        grid = {
+            "mass": args.mass,
+            "metallicity": args.metallicity,
+            "zams_velocity": args.zams_velocity,
+        }
+    os.makedirs(args.output, exist_ok=True)
+
+    points = grid_points(grid)
+    todo = [
+        point for point in points
+        if not os.path.exists(done_filename(args.output, star_name(point)))
+    ]
+    print(
+        f"{len(points)} stars in grid, {len(points) - len(todo)} already "
+        f"done, {len(todo)} to run"
+    )
+    if not todo:
+        return
+
+    stars = Particles()
+    names = {}
+    for point in todo:
+        name = star_name(point)
+        # Unfinished stars are restarted, so their old track is removed
+        if os.path.exists(track_filename(args.output, name)):
+            os.remove(track_filename(args.output, name))
+        star = stars.add_particle(Particle(
+            mass=point["mass"] | units.MSun,
+            metallicity=point["metallicity"],
+            zams_velocity=point["zams_velocity"],
+            star_name=name,
+            magnetic=False,
+            anisotropic=False,
+        ))
+        names[star.key] = name
+
+    if args.verbose:
+        code = GenecMultiple(
+            max_number_of_workers=args.workers, multiplex=True,
+            redirection="none",
+        )
+    else:
+        code = GenecMultiple(
+            max_number_of_workers=args.workers, multiplex=True,
+        )
+    code.parameters["checkpoint_interval"] = args.checkpoint_interval
+    code.particles.add_particles(stars)
+
+    time_start = time.time()
+    finished = []
+
+    # tracks are written in the background, one open timeline per star
+    writer = BackgroundWriter()
+    timelines = {}
+
+    def write_track(star):
+        if star.key not in timelines:
+            timelines[star.key] = TimelineWriter(
+                track_filename(args.output, names[star.key])
+            )
+        writer.submit(
+            timelines[star.key].add, star.as_set().copy(), star.age
+        )
+
+    def harvest(star, model):
+        name = names[star.key]
+        if star.key in timelines:
+            writer.submit(timelines.pop(star.key).close)
+        writer.flush()
+        with open(final_model_filename(args.output, name), "wb") as outstream:
+            pickle.dump(model, outstream)
+        # Written last, so that an interrupted star is run again
+        with open(done_filename(args.output, name), "w") as outfile:
+            json.dump(
+                {
+                    "reason": code.particles.retired[star.key],
+                    "age": star.age.value_in(units.Myr),
+                    "mass": star.mass.value_in(units.MSun),
+                },
+                outfile,
+            )
+        finished.append(name)
+        hours = (time.time() - time_start) / 3600
+        print(
+            f"\n{name} done ({code.particles.retired[star.key]}), "
+            f"{len(finished)}/{len(todo)}, "
+            f"{len(finished) / hours:.2f} stars per hour"
+        )
+
+    try:
+        code.run_queue(
+            args.age | units.Myr, on_finish=harvest, on_step=write_track
+        )
+    finally:
+        try:
+            writer.close()
+        finally:
+            # unfinished stars, their tracks are written again on a rerun
+            for timeline in timelines.values():
+                timeline.close()
+    hours = (time.time() - time_start) / 3600
+    print(
+        f"Ran {len(finished)} stars in {hours:.2f} hours, "
+        f"{len(finished) / hours:.2f} stars per hour"
+    )
+    return 0 if len(finished) == len(todo) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Per-step telemetry for single-star runs.
+Every step is recorded as one row with the wall time split into phases
+(the GENEC step, fetching profiles, backup I/O and plotting, the rest is
+other), and the state of the star: age, time step, number of zones and
+evolutionary phase. Rows go to a CSV file that is rotated when it gets
+long, and/or to a text file in the Prometheus exposition format, rewritten
+every few steps:
+
+    telemetry = StepTelemetry(csv_filename="star.telemetry.csv")
+    with telemetry.timed("step"):
+        star.evolve_one_step()
+    telemetry.step_done(step, star)
+
+Backup I/O is done in a background thread, so its time here is the time
+the run waited for the writer.
+"""
+
+import os
+import csv
+from time import perf_counter
+from contextlib import contextmanager
+
+from amuse.units import units
+
+PHASES = ("step", "profiles", "backup", "plot")
+COLUMNS = (
+    "step", "start", "wall_time",
+    *(f"{phase}_time" for phase in PHASES), "other_time",
+    "age", "time_step", "n_zones", "phase",
+)
+
+
+class StepTelemetry:
+    """
+    Records per step the wall time of every phase in PHASES (seconds),
+    age and time step (yr), number of zones and evolutionary phase. The
+    CSV file is moved to csv_filename.1 after rotate_rows rows; the
+    Prometheus file is rewritten every prometheus_every steps.
+    """
+    def __init__(
+        self, csv_filename=None, prometheus_filename=None,
+        rotate_rows=100000, prometheus_every=10,
+    ):
+        self.csv_filename = csv_filename
+        self.prometheus_filename = prometheus_filename
+        self.rotate_rows = rotate_rows
+        self.prometheus_every = prometheus_every
+        self.time_start = perf_counter()
+        self.last = None
+        self.steps = 0
+        # totals per phase, overall and per evolutionary phase
+        self.totals = {}
+        self.totals_per_phase = {}
+        self.__times = dict.fromkeys(PHASES, 0.)
+        self.__step_start = self.time_start
+        self.__csv_rows = 0
+        self.__csv_file = None
+        self.__csv_writer = None
+
+    @contextmanager
+    def timed(self, phase):
+        "Count the time spent in the with block to phase"
+        time_start = perf_counter()
+        try:
+            yield
+        finally:
+            self.__times[phase] += perf_counter() - time_start
+
+    def step_done(self, step, star):
+        """
+        Finish the row of step, with the state of star (or a
+        ProfileSnapshot) at the start of the step
+        """
+        now = perf_counter()
+        row = {
+            "step": step,
+            "start": self.__step_start - self.time_start,
+            "wall_time": now - self.__step_start,
+        }
+        for phase in PHASES:
+            row[f"{phase}_time"] = self.__times[phase]
+        row["other_time"] = row["wall_time"] - sum(self.__times.values())
+        row["age"] = star.age.value_in(units.julianyr)
+        row["time_step"] = star.time_step.value_in(units.julianyr)
+        row["n_zones"] = star.n_zones
+        row["phase"] = star.get_phase()
+        self.__times = dict.fromkeys(PHASES, 0.)
+        self.__step_start = now
+        self.last = row
+        self.steps += 1
+        for totals in (
+            self.totals,
+            self.totals_per_phase.setdefault(row["phase"], {}),
+        ):
+            for column in ("wall_time", "other_time") + tuple(
+                f"{phase}_time" for phase in PHASES
+            ):
+                totals[column] = totals.get(column, 0.) + row[column]
+            totals["steps"] = totals.get("steps", 0) + 1
+        if self.csv_filename is not None:
+            self.write_csv_row(row)
+        if (
+            self.prometheus_filename is not None
+            and self.steps % self.prometheus_every == 0
+        ):
+            self.write_prometheus()
+
+    def write_csv_row(self, row):
+        if self.__csv_rows >= self.rotate_rows:
+            self.__csv_file.close()
+            os.replace(self.csv_filename, self.csv_filename + ".1")
+            self.__csv_file = None
+        if self.__csv_file is None:
+            self.__csv_file = open(self.csv_filename, "w", newline="")
+            self.__csv_writer = csv.DictWriter(
+                self.__csv_file, fieldnames=COLUMNS
+            )
+            self.__csv_writer.writeheader()
+            self.__csv_rows = 0
+        self.__csv_writer.writerow(row)
+        self.__csv_file.flush()
+        self.__csv_rows += 1
+
+    def write_prometheus(self):
+        "Write the totals and the last step in the Prometheus text format"
+        lines = [
+            "# TYPE genec_steps_total counter",
+            f"genec_steps_total {self.steps}",
+            "# TYPE genec_phase_seconds_total counter",
+        ]
+        for evolutionary_phase, totals in sorted(
+            self.totals_per_phase.items()
+        ):
+            for phase in PHASES + ("other",):
+                lines.append(
+                    f'genec_phase_seconds_total{{phase="{phase}",'
+                    f'evolutionary_phase="{evolutionary_phase}"}} '
+                    f'{totals[f"{phase}_time"]}'
+                )
+        if self.last is not None:
+            for column in ("age", "time_step", "n_zones", "phase"):
+                lines += [
+                    f"# TYPE genec_{column} gauge",
+                    f"genec_{column} {self.last[column]}",
+                ]
+        with open(self.prometheus_filename + ".tmp", "w") as outfile:
+            outfile.write("\n".join(lines) + "\n")
+        os.replace(self.prometheus_filename + ".tmp", self.prometheus_filename)
+
+    def summary(self):
+        """
+        Fraction of the wall time spent in every phase (and other), for
+        the whole run and per evolutionary phase
+        """
+        def fractions(totals):
+            wall_time = totals.get("wall_time", 0.)
+            return {
+                phase: (
+                    totals[f"{phase}_time"] / wall_time
+                    if wall_time > 0 else 0.
+                )
+                for phase in PHASES + ("other",)
+            }
+        summary = {"all": fractions(self.totals)}
+        for evolutionary_phase, totals in self.totals_per_phase.items():
+            summary[evolutionary_phase] = fractions(totals)
+        return summary
+
+    def close(self):
+        if self.prometheus_filename is not None and self.steps > 0:
+            self.write_prometheus()
+        if self.__csv_file is not None:
+            self.__csv_file.close()
+            self.__csv_file = None
@@ -0,0 +1,84 @@
+"""
+Tests for abundance_archive (no GENEC needed):
+python -m pytest
+"""
+import os
+
+import numpy
+import pytest
+
+from abundance_archive import INDEX_DTYPE, LOG_MIN, AbundanceArchive
+
+SPECIES = ["h", "he4", "c12"]
+
+
+def new_profiles(step):
+    "Abundances (species x zones), with a number of zones that changes"
+    random = numpy.random.default_rng(step)
+    zones = 20 + 3 * step
+    return 10**random.uniform(-35, 0, size=(len(SPECIES), zones))
+
+
+@pytest.mark.parametrize("storage", ["float64", "float32"])
+def test_round_trip(tmp_path, storage):
+    archive = AbundanceArchive(
+        str(tmp_path / "star"), storage=storage, species=SPECIES
+    )
+    for step in range(4):
+        archive.append(new_profiles(step), step, 1e3 * step)
+    rtol = 1e-7 if storage == "float32" else 0
+    for step in range(4):
+        numpy.testing.assert_allclose(
+            archive.profiles(step), new_profiles(step), rtol=rtol
+        )
+    assert list(archive.zones) == [20, 23, 26, 29]
+    central = archive.species("he4", zone=0)
+    numpy.testing.assert_allclose(
+        central, [new_profiles(step)[1, 0] for step in range(4)], rtol=rtol
+    )
+
+
+def test_log16_error_bound(tmp_path):
+    archive = AbundanceArchive(str(tmp_path / "star"), storage="log16")
+    profiles = new_profiles(0)
+    archive.append(profiles)
+    decoded = archive.profiles(0)
+    floor = 10**LOG_MIN
+    above = profiles >= floor
+    assert (~above).any()
+    relative_error = numpy.abs(decoded[above] / profiles[above] - 1)
+    assert relative_error.max() <= 6e-4
+    numpy.testing.assert_allclose(decoded[~above], floor)
+
+
+def test_reopen_and_append(tmp_path):
+    name = str(tmp_path / "star")
+    archive = AbundanceArchive(name, storage="log16", species=SPECIES)
+    archive.append(new_profiles(0), 0)
+    archive = AbundanceArchive(name)
+    assert archive.storage == "log16"
+    assert archive.species_names == SPECIES
+    archive.append(new_profiles(1), 1)
+    archive = AbundanceArchive(name)
+    assert list(archive.steps) == [0, 1]
+    assert [len(h) for h in archive.species("h")] == [20, 23]
+
+
+def test_truncated_index(tmp_path):
+    name = str(tmp_path / "star")
+    archive = AbundanceArchive(name, species=SPECIES)
+    for step in range(2):
+        archive.append(new_profiles(step), step)
+    # a record that was only partly written
+    with open(archive.index_filename, "ab") as outstream:
+        outstream.write(b"\x01" * (INDEX_DTYPE.itemsize // 2))
+    archive = AbundanceArchive(name)
+    assert len(archive) == 2
+    assert os.path.getsize(archive.index_filename) == 2 * INDEX_DTYPE.itemsize
+    archive.append(new_profiles(2), 2)
+    archive = AbundanceArchive(name)
+    assert list(archive.steps) == [0, 1, 2]
+    for step in range(3):
+        numpy.testing.assert_array_equal(
+            archive.profiles(step), new_profiles(step)
+        )
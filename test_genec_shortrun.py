@@ -5,22 +5,39 @@ import sys
 import pickle
 from amuse.units import units
 from amuse.datamodel import Particle
-from amuse.community.genec import Genec
+
+from checkpoint_writer import BackgroundWriter
+from genecsession import GenecSession
+from track_store import TrackStore
+
+TRACK_STORES = {}
+# store every this many models in full, and deltas in between
+KEYFRAME_EVERY = 10
 
 
 def write_genec_model(model):
-    "Write a GENEC model to a pickle file"
-    with open(
-        f"{model['star_name']}-{model['nwmd']:09d}.pkl", 'wb'
-    ) as outstream:
-        pickle.dump(model, outstream)
+    "Append a GENEC model to the track store of its star"
+    if model['star_name'] not in TRACK_STORES:
+        TRACK_STORES[model['star_name']] = TrackStore(
+            model['star_name'], compress=True, keyframe_every=KEYFRAME_EVERY,
+        )
+    TRACK_STORES[model['star_name']].append(model)
 
 
-def read_genec_model(filename):
-    "Read a GENEC model from file"
-    with open(filename, 'rb') as instream:
-        model = pickle.load(instream)
-    return model
+def read_genec_model(filename, nwmd=None):
+    """
+    Read a GENEC model from a track store (the last one, or model number
+    nwmd), or from an old-style pickle file
+    """
+    if filename.endswith('.pkl'):
+        with open(filename, 'rb') as instream:
+            model = pickle.load(instream)
+        return model
+    if filename.endswith('.track'):
+        filename = filename[:-len('.track')]
+    return TrackStore(filename, keyframe_every=KEYFRAME_EVERY).model(
+        nwmd
+    ).load()
 
 
 def initial_model(
@@ -28,11 +45,12 @@ def initial_model(
     metallicity=0.014,
     zams_velocity=0.5,  # this is vwant
     star_name='MyStar',
+    session=None,
 ):
     """
-    Generate the initial GENEC model.
+    Generate the initial GENEC model, in session if given (and otherwise
+    in a worker of its own).
     """
-    instance = Genec(redirection="none")
     star = Particle(
         mass=mass,
         metallicity=metallicity,
@@ -41,39 +59,47 @@ def initial_model(
         magnetic=False,
         anisotropic=False,
     )
-    star_in_code = instance.new_particles.add_particle(star)
-    model = star_in_code.get_internal_structure()
-    instance.stop()
-    return model
+    if session is None:
+        with GenecSession(redirection="none") as session:
+            session.load(particle=star)
+            return session.get_internal_structure()
+    session.load(particle=star)
+    return session.get_internal_structure()
 
 
-def step(model, number_of_steps_per_step=100):
+def step(model, number_of_steps_per_step=100, session=None):
     """
     Evolve GENEC for number_of_steps_per_step and return the new model.
+    With a session, the model is loaded into its running worker instead of
+    into a new one, and a model the session just returned is not reloaded.
     """
-    instance = Genec(redirection="none")
-    instance.new_particle_from_model(model)
-    for i in range(number_of_steps_per_step):
-        instance.evolve_one_step(0)
-    model = instance.get_internal_structure(0)
-    instance.stop()
-    return model
+    if session is None:
+        with GenecSession(redirection="none") as session:
+            return step(model, number_of_steps_per_step, session)
+    session.load(model)
+    session.evolve(number_of_steps_per_step)
+    return session.get_internal_structure()
 
 
 def main():
     "Run GENEC"
     write = True
     number_of_steps = int(sys.argv[1])
-    if len(sys.argv) > 2:
-        read_genec_model(sys.argv[2])
-    else:
-        model = initial_model()
-        if write:
-            write_genec_model(model)
-    for i in range(number_of_steps):
-        model = step(model)
-        if write:
-            write_genec_model(model)
+    with GenecSession(redirection="none") as session, \
+            BackgroundWriter() as writer:
+        if len(sys.argv) > 2:
+            model = read_genec_model(
+                sys.argv[2],
+                nwmd=int(sys.argv[3]) if len(sys.argv) > 3 else None,
+            )
+        else:
+            model = initial_model(session=session)
+            if write:
+                writer.submit(write_genec_model, model)
+        for i in range(number_of_steps):
+            model = step(model, session=session)
+            if write:
+                writer.submit(write_genec_model, model)
 
 
 if __name__ == "__main__":
@@ -1,16 +1,39 @@
+"""
+Evolve a single GENEC star, saving its timeline and abundance profiles.
+Runs without plots unless --plot (or --live-plot, to plot in a separate
+process) is given, and stops at --max-age, --max-phase, a GENEC stopping
+condition, when the star stalls, when the wall-clock budget (--wall-time)
+is used up, or on SIGTERM. The internal structure is checkpointed every
+--checkpoint-every steps and at the end, and running again with the key of
+the star continues from there; the exit status is 1 if the star stalled or the
+run was cut short.
+
+    python test_integrate_default_star.py --mass 7 --max-age 50 --plot
+    python test_integrate_default_star.py 12345 --wall-time 600
+"""
+import os
 import sys
 import numpy
 import time
+import signal
+import pickle
+import argparse
+from contextlib import ExitStack
 
 from amuse.datamodel import Particle
 from amuse.units import units
+from amuse.units.quantities import is_quantity
 from amuse.community.genec import Genec
 from amuse.io import write_set_to_file, read_set_from_file
 from amuse.support.console import set_printing_strategy
 
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from plot_models import StellarModelPlot
+from genecsession import load_star
+from profile_snapshot import ProfileSnapshot, PLOT_PROFILES
+from checkpoint_writer import BackgroundWriter, write_checkpoint
+from timeline_writer import TimelineWriter
+from timeline_reader import TimelineReader
+from abundance_archive import AbundanceArchive
+from step_telemetry import StepTelemetry
 
 from amuse.community.genec.interface import SPECIES_NAMES
 import logging
@@ -24,9 +47,50 @@ logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG)
 
 
+# Relative change since the last saved model above which a model is saved
+SAVE_THRESHOLDS = {
+    'luminosity': 0.01,
+    'temperature': 0.005,
+    'central_temperature': 0.01,
+    'central_density': 0.02,
+    'surface_velocity': 0.05,
+    'mass': 0.001,
+}
+SPECIES_THRESHOLD = 0.01
+# abundances below this are compared to it instead, so that traces of a
+# species don't trigger saves
+ABUNDANCE_FLOOR = 1e-3
+
+
+def relative_change(old, new, floor=None):
+    "abs(new - old) relative to the largest of old, new and floor"
+    difference = abs(new - old)
+    if difference == 0 * difference:
+        return 0.
+    scale = max(abs(old), abs(new))
+    if floor is not None:
+        scale = max(scale, floor)
+    change = difference / scale
+    if is_quantity(change):
+        return change.value_in(units.none)
+    return change
+
+
 class NeedToSave:
-    def __init__(self):
+    """
+    Adaptive output cadence: a model is saved when one of the quantities
+    changed by more than its threshold (relative, see SAVE_THRESHOLDS)
+    since the last saved model, and at least every max_gap models.
+    """
+    def __init__(self, thresholds=None, max_gap=100):
         self.model = 0
+        self.model_of_last_save = None
+        self.max_gap = max_gap
+        self.thresholds = dict(SAVE_THRESHOLDS)
+        for species in SPECIES_NAMES.keys():
+            self.thresholds[species] = SPECIES_THRESHOLD
+        if thresholds is not None:
+            self.thresholds.update(thresholds)
         self.current = {
             'luminosity': 0 | units.LSun,
             'temperature': 0 | units.K,
@@ -37,8 +101,10 @@ class NeedToSave:
             'time_step': 0 | units.s,
         }
         for species in SPECIES_NAMES.keys():
-            self.current[species] = []
+            self.current[species] = 0.
         self.previous = self.current.copy()
+        self.saved = self.current.copy()
+        # relative change per model
         self.derivs = {}
         for key in self.current.keys():
             self.derivs[key] = 1
@@ -47,21 +113,47 @@ class NeedToSave:
     def get_values(self):
         return self.current
 
+    def change_since_save(self, key):
+        floor = ABUNDANCE_FLOOR if key in SPECIES_NAMES else None
+        return relative_change(self.saved[key], self.current[key], floor)
+
     @property
     def save_next(self):
-        return True
+        "Whether the current model should be saved"
+        if self.model_of_last_save is None:
+            return True
+        if self.model - self.model_of_last_save >= self.max_gap:
+            return True
+        return any(
+            self.change_since_save(key) > threshold
+            for key, threshold in self.thresholds.items()
+        )
 
     def update(self, star):
+        self.model += 1
         self.previous = self.current.copy()
         for key in self.current.keys():
             self.current[key] = getattr(star, key)
+        for key in self.thresholds.keys():
+            floor = ABUNDANCE_FLOOR if key in SPECIES_NAMES else None
+            self.derivs[key] = relative_change(
+                self.previous[key], self.current[key], floor
+            )
+
+    def save_done(self):
+        "Mark the current model as saved"
+        self.saved = self.current.copy()
+        self.model_of_last_save = self.model
 
 
 def read_saved_star_timeline(star_key):
-    star = read_set_from_file(f'star-{star_key}.amuse')[0]
-    age, radius = star.get_timeline_of_attribute_as_vector('radius')
+    filename = f'star-{star_key}.amuse'
+    with TimelineReader(filename) as timeline:
+        age = timeline.ages()
+        radius = timeline.quantity('radius')
     print(age.in_(units.yr))
     print(radius.in_(units.RSun))
+    star = read_set_from_file(filename)[0]
     return star
 
 
@@ -70,7 +162,16 @@ def write_backup(
     star,
     abundances,
     append=True,
+    timeline=None,
+    archive=None,
 ):
+    if archive is not None:
+        archive.append(
+            abundances, step, star.age.value_in(units.julianyr)
+        )
+    if append and timeline is not None:
+        timeline.add(star.as_set(), star.age)
+        return
     if append:
         filename = f'star-{star.key}.amuse'
     else:
@@ -82,12 +183,6 @@ def write_backup(
         append_to_file=append,
         compression=True,
     )
-
-    # For now, abundances aren't part of the single star particle
-    # numpy.savez_compressed(
-    #     f'star-abundances-{star.key}-{step}.npz',
-    #     abundances=abundances,
-    # )
     return
 
 MASS_UNIT = units.MSun
@@ -117,109 +212,305 @@ star_difficult = Particle(
     metallicity=0.014,
 )
 
-if len(sys.argv) > 1:
-    star = read_saved_star_timeline(sys.argv[1])
-else:
-    star = Particle(
-        mass=7.0 | units.MSun,
-        metallicity=0.014,
-        starname="AmuseStar",
-        zams_velocity=0.,
-    )
-evo = Genec(redirection="none")
-# evo = Genec()
 
-star_in_evo = evo.particles.add_particle(star)
+def checkpoint_filename(star_key):
+    return f'star-{star_key}-checkpoint.pkl'
 
-font = {
-    'size': 8,
-}
-plt.rc('font', **font)
-# iplt.switch_backend('macosx')
-plt.ion()
-
-save_every = 10
-store_every = 1
-plot_time = 10 | units.s
-plot_models = 1
-step = 0
-
-model_of_last_save = 0
-model_of_last_plot = 0
-time_start = time.time() | units.s
-time_of_last_plot = 0 | units.s
-age_of_last_plot = star_in_evo.age
-
-plotting = None
-plotting = StellarModelPlot(star_in_evo)
-
-# evo.parameters.nzmod = 100
-
-# print("age   mass   radius   temp   lum   phase   vequat   h0   vwant  xcn")
-while True:
-    time_elapsed = (time.time() | units.s) - time_start
-    star = star_in_evo.copy()
-    # number_of_zones = star_in_evo.get_number_of_zones()
-    # density_profile = star_in_evo.get_density_profile()
-    # radius_profile = star_in_evo.get_radius_profile()
-    # temperature_profile = star_in_evo.get_temperature_profile()
-    # luminosity_profile = star_in_evo.get_luminosity_profile()
-    # pressure_profile = star_in_evo.get_pressure_profile()
-    chemical_abundance_profile = star_in_evo.get_chemical_abundance_profiles()
-
-    # print(evo.particles[0])
-    # print(evo.particles[0].get_number_of_species())
-    # print(evo.particles[0].get_names_of_species())
-    # print(evo.particles[0].get_mass_profile())
-    # exit()
-    print(
-        star.age.in_(units.Myr),
-        star.mass.in_(units.MSun),
-        star.radius.in_(units.RSun),
-        star.temperature.in_(units.K),
-        star.luminosity.in_(units.LSun),
-        star.surface_velocity,
+
+def new_argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "star_key", nargs="?", type=int,
+        help="continue the star with this key from its checkpoint or file",
+    )
+    parser.add_argument("--mass", type=float, default=7.0, help="in MSun")
+    parser.add_argument("--metallicity", type=float, default=0.014)
+    parser.add_argument("--zams-velocity", type=float, default=0.)
+    parser.add_argument("--max-age", type=float, help="in Myr")
+    parser.add_argument("--max-phase", type=int)
+    parser.add_argument("--max-steps", type=int)
+    parser.add_argument(
+        "--stall-steps", type=int, default=10,
+        help="stop if the age doesn't increase for this many steps",
+    )
+    parser.add_argument(
+        "--wall-time", type=float,
+        help="wall-clock budget in minutes, stops before exceeding it",
+    )
+    parser.add_argument(
+        "--max-save-gap", type=int, default=100,
+        help="save at least every this many steps",
+    )
+    parser.add_argument(
+        "--checkpoint-every", type=int, default=100,
+        help="checkpoint the internal structure every this many steps",
     )
-    print(f"step: {step} time: {star.age} timestep: {star.time_step}")
-    if (step % store_every == 0) and plotting is not None:
-        plotting.update(star_in_evo)
-        if (
-            (time_elapsed - time_of_last_plot) > plot_time
-            or step - model_of_last_plot > plot_models
+    parser.add_argument("--plot", action="store_true")
+    parser.add_argument(
+        "--live-plot", action="store_true",
+        help="plot in a separate process, dropping frames if it lags",
+    )
+    parser.add_argument(
+        "--telemetry", metavar="CSV",
+        help="write the timings and state of every step to this CSV file",
+    )
+    parser.add_argument(
+        "--prometheus", metavar="FILE",
+        help="write telemetry totals to this file in Prometheus format",
+    )
+    return parser
+
+
+class Stopper:
+    """
+    Stopping criteria of a run: final age and phase, GENEC stopping
+    conditions, a star that doesn't evolve any more, the wall-clock budget
+    and SIGTERM.
+    """
+    def __init__(
+        self, max_age=None, max_phase=None, max_steps=None, stall_steps=10,
+        wall_time=None,
+    ):
+        self.max_age = max_age
+        self.max_phase = max_phase
+        self.max_steps = max_steps
+        self.stall_steps = stall_steps
+        self.wall_time = wall_time
+        self.time_start = time.time()
+        self.steps = 0
+        self.stalled_steps = 0
+        self.age = None
+        self.terminated = False
+        signal.signal(signal.SIGTERM, self.terminate)
+
+    def terminate(self, signum, frame):
+        print("SIGTERM received, stopping after this step")
+        self.terminated = True
+
+    def reason(self, star, stopping_condition):
+        "Why the run should stop after this step, or None to continue"
+        self.steps += 1
+        if self.age is not None and star.age <= self.age:
+            self.stalled_steps += 1
+        else:
+            self.stalled_steps = 0
+        self.age = star.age
+        elapsed = time.time() - self.time_start
+        if self.terminated:
+            return "terminated"
+        if stopping_condition != "none":
+            return f"stopping condition {stopping_condition}"
+        if self.max_age is not None and star.age >= self.max_age:
+            return "age"
+        if self.max_phase is not None and star.get_phase() >= self.max_phase:
+            return "phase"
+        if self.max_steps is not None and self.steps >= self.max_steps:
+            return "steps"
+        if self.stall_steps is not None and (
+            self.stalled_steps >= self.stall_steps
+        ):
+            return "stalled"
+        # stop if another step of average duration wouldn't fit
+        if self.wall_time is not None and (
+            elapsed * (self.steps + 1) / self.steps > self.wall_time
         ):
-            speed = (
-                (star.age - age_of_last_plot).value_in(units.Myr)
-                / (time_elapsed - time_of_last_plot).value_in(units.minute)
-            ) | units.Myr / units.minute
-            plotting.plot_all(speed=speed, step=step)
-            model_of_last_plot = step
-            time_of_last_plot = time_elapsed
-            age_of_last_plot = star.age
-
-    if step % save_every == 0:
-        write_backup(
+            return "wall time"
+        return None
+
+
+def new_star(args, evo):
+    "Add the star to evo: from its checkpoint or file, or a new one"
+    if args.star_key is None:
+        return evo.particles.add_particle(Particle(
+            mass=args.mass | units.MSun,
+            metallicity=args.metallicity,
+            starname="AmuseStar",
+            zams_velocity=args.zams_velocity,
+        ))
+    if os.path.exists(checkpoint_filename(args.star_key)):
+        with open(checkpoint_filename(args.star_key), "rb") as instream:
+            model = pickle.load(instream)
+        return load_star(evo, model, key=args.star_key)
+    star = read_saved_star_timeline(args.star_key)
+    return evo.particles.add_particle(star)
+
+
+def main():
+    args = new_argument_parser().parse_args()
+    stopper = Stopper(
+        max_age=(
+            None if args.max_age is None else args.max_age | units.Myr
+        ),
+        max_phase=args.max_phase,
+        max_steps=args.max_steps,
+        stall_steps=args.stall_steps,
+        wall_time=None if args.wall_time is None else args.wall_time * 60,
+    )
+    evo = Genec(redirection="none")
+    # evo = Genec()
+
+    star_in_evo = new_star(args, evo)
+
+    store_every = 1
+    plot_time = 10 | units.s
+    plot_models = 1
+    step = 0
+
+    model_of_last_plot = 0
+    time_start = time.time() | units.s
+    time_of_last_plot = 0 | units.s
+    age_of_last_plot = star_in_evo.age
+
+    plotting = None
+    if args.plot:
+        import matplotlib.pyplot as plt
+        from plot_models import StellarModelPlot
+        font = {
+            'size': 8,
+        }
+        plt.rc('font', **font)
+        # iplt.switch_backend('macosx')
+        plt.ion()
+        plotting = StellarModelPlot(ProfileSnapshot(star_in_evo))
+    live_plot = None
+    if args.live_plot:
+        from live_plot import LivePlot
+        live_plot = LivePlot()
+    writer = BackgroundWriter()
+    need_to_save = NeedToSave(max_gap=args.max_save_gap)
+    # only used from the writer thread
+    timeline = TimelineWriter(f'star-{star_in_evo.key}.amuse')
+    # abundances aren't part of the single star particle, so they are
+    # archived separately
+    abundance_archive = AbundanceArchive(
+        f'star-abundances-{star_in_evo.key}',
+        storage="float32",
+        species=star_in_evo.get_names_of_species(),
+    )
+
+    # evo.parameters.nzmod = 100
+
+    telemetry = StepTelemetry(
+        csv_filename=args.telemetry, prometheus_filename=args.prometheus
+    )
+    try:
+        while True:
+            time_elapsed = (time.time() | units.s) - time_start
+            # the state and profiles of this step, fetched once for
+            # printing, saving and plotting; other profiles are fetched
+            # when plotting
+            with telemetry.timed("profiles"):
+                star = ProfileSnapshot(
+                    star_in_evo, profiles=("chemical_abundance",)
+                )
+                chemical_abundance_profile = (
+                    star.get_chemical_abundance_profiles()
+                )
+            print(
+                star.age.in_(units.Myr),
+                star.mass.in_(units.MSun),
+                star.radius.in_(units.RSun),
+                star.temperature.in_(units.K),
+                star.luminosity.in_(units.LSun),
+                star.surface_velocity,
+            )
+            print(f"step: {step} time: {star.age} timestep: {star.time_step}")
+            if (step % store_every == 0) and plotting is not None:
+                with telemetry.timed("plot"):
+                    plotting.update(star)
+                if (
+                    (time_elapsed - time_of_last_plot) > plot_time
+                    or step - model_of_last_plot > plot_models
+                ):
+                    speed = (
+                        (star.age - age_of_last_plot).value_in(units.Myr)
+                        / (time_elapsed - time_of_last_plot).value_in(
+                            units.minute
+                        )
+                    ) | units.Myr / units.minute
+                    with telemetry.timed("profiles"):
+                        for name in PLOT_PROFILES:
+                            star.profile(name)
+                    with telemetry.timed("plot"):
+                        plotting.plot_all(speed=speed, step=step)
+                    model_of_last_plot = step
+                    time_of_last_plot = time_elapsed
+                    age_of_last_plot = star.age
+
+            if (step % store_every == 0) and live_plot is not None:
+                with telemetry.timed("plot"):
+                    live_plot.update(star, step)
+
+            need_to_save.update(star)
+            if need_to_save.save_next:
+                need_to_save.save_done()
+                with telemetry.timed("backup"):
+                    writer.submit(
+                        write_backup,
+                        step,
+                        star,
+                        chemical_abundance_profile,
+                        timeline=timeline,
+                        archive=abundance_archive,
+                    )
+
+            if step > 0 and step % args.checkpoint_every == 0:
+                # so that a killed job loses at most checkpoint_every steps
+                with telemetry.timed("backup"):
+                    writer.submit(timeline.flush)
+                    writer.submit(
+                        write_checkpoint,
+                        star_in_evo.get_internal_structure(),
+                        checkpoint_filename(star_in_evo.key),
+                    )
+
+            with telemetry.timed("step"):
+                star_in_evo.evolve_one_step()
+            telemetry.step_done(step, star)
+            step += 1
+            reason = stopper.reason(
+                star_in_evo, evo.parameters.stopping_condition
+            )
+            if reason is not None:
+                break
+
+        print(f"Stopping: {reason}")
+        # the final state is always saved
+        star = ProfileSnapshot(star_in_evo, profiles=("chemical_abundance",))
+        writer.submit(
+            write_backup,
             step,
             star,
-            # density_profile,
-            # radius_profile,
-            # temperature_profile,
-            # luminosity_profile,
-            # pressure_profile,
-            chemical_abundance_profile,
+            star.get_chemical_abundance_profiles(),
+            timeline=timeline,
+            archive=abundance_archive,
+        )
+        writer.submit(
+            write_checkpoint,
+            star_in_evo.get_internal_structure(),
+            checkpoint_filename(star_in_evo.key),
         )
+    finally:
+        # the callbacks run in reverse order, all of them even if one fails;
+        # the timeline is closed after the writer thread has stopped
+        with ExitStack() as cleanup:
+            cleanup.callback(evo.stop)
+            if live_plot is not None:
+                cleanup.callback(live_plot.close)
+            cleanup.callback(telemetry.close)
+            cleanup.callback(timeline.close)
+            cleanup.callback(writer.close)
+    runtime = (time.time() | units.s) - time_start
+    for phase, fractions in telemetry.summary().items():
+        print(f"Fraction of wall time in phase {phase}:", ", ".join(
+            f"{name} {fraction:.1%}" for name, fraction in fractions.items()
+        ))
+    print(
+        f"Running {step} models took {runtime.value_in(units.minute)} "
+        "minutes"
+    )
+    return 0 if reason not in ("stalled", "terminated", "wall time") else 1
 
-    age_previous = star_in_evo.age
-    star_in_evo.evolve_one_step()
-    # print(f"Condition: {evo.parameters.stopping_condition}")
-    # if evo.parameters.stopping_condition != "none":
-    #     # star_in_evo.age == age_previous:
-    #     if step > 1:
-    #         print("Stopping - not evolving!")
-    #         print(f"Condition: {evo.parameters.stopping_condition}")
-    #         break
-    step += 1
-
-runtime = (time.time() | units.s) - time_start
-print(
-    f"Running {step} models took {runtime.value_in(units.minute)} minutes"
-)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Tests for model_delta and delta storage in track_store (no GENEC needed):
+python -m pytest
+"""
+import numpy
+
+from model_delta import apply_delta, is_delta, make_delta
+from track_store import TrackStore
+
+
+def new_models(number_of_models=7, number_of_zones=40):
+    "Consecutive models, with small and large changes and a shape change"
+    random = numpy.random.default_rng(2)
+    models = []
+    radius = random.random(number_of_zones)
+    for nwmd in range(number_of_models):
+        radius = radius.copy()
+        if nwmd % 2:
+            radius[nwmd] *= 1.0001              # few elements: sparse
+        else:
+            radius *= 1 + 1e-9 * nwmd           # all elements: XOR
+        zones = number_of_zones + (5 if nwmd >= 4 else 0)
+        models.append({
+            "nwmd": nwmd,
+            "alter": 1e6 * nwmd,
+            "phase": 1 if nwmd < 3 else 2,
+            "radius": radius,
+            "density": numpy.full(zones, float(nwmd >= 4)),
+            "special": numpy.array([numpy.nan, -0.0, numpy.inf]),
+        })
+    return models
+
+
+def assert_identical(model, expected):
+    assert list(model.keys()) == list(expected.keys())
+    for name, value in expected.items():
+        if isinstance(value, numpy.ndarray):
+            assert model[name].dtype == value.dtype
+            assert model[name].shape == value.shape
+            assert model[name].tobytes() == value.tobytes()
+        else:
+            assert model[name] == value
+
+
+def test_delta_is_exact():
+    models = new_models()
+    for previous, model in zip(models, models[1:]):
+        delta = make_delta(previous, model, base=previous["nwmd"])
+        assert is_delta(delta)
+        assert_identical(apply_delta(previous, delta), model)
+
+
+def test_delta_stores_only_changes():
+    previous, model = new_models()[:2]
+    delta = make_delta(previous, model)
+    assert "special" not in delta
+    assert "phase" not in delta
+    assert "radius@indices" in delta
+    assert "radius@xor" in make_delta(model, new_models()[2])
+
+
+def test_shape_change():
+    models = new_models()
+    delta = make_delta(models[3], models[4])
+    assert delta["density"].shape == models[4]["density"].shape
+    assert_identical(apply_delta(models[3], delta), models[4])
+
+
+def test_new_and_removed_fields():
+    previous = {"nwmd": 1, "radius": numpy.ones(3)}
+    model = {"nwmd": 2, "mass": numpy.zeros(3)}
+    assert_identical(apply_delta(previous, make_delta(previous, model)), model)
+
+
+def test_track_store_across_keyframes(tmp_path):
+    models = new_models()
+    store = TrackStore(
+        str(tmp_path / "star"), compress=True, keyframe_every=3
+    )
+    for model in models:
+        store.append(model)
+    for model in models:
+        assert_identical(store.model(model["nwmd"]).load(), model)
+    history = store.scalar_history(["phase"])
+    numpy.testing.assert_array_equal(
+        history["phase"], [model["phase"] for model in models]
+    )
+
+
+def test_track_store_deltas_after_reopen(tmp_path):
+    models = new_models()
+    store = TrackStore(str(tmp_path / "star"), keyframe_every=3)
+    for model in models[:4]:
+        store.append(model)
+    store = TrackStore(str(tmp_path / "star"), keyframe_every=3)
+    for model in models[4:]:
+        store.append(model)
+    for model in models:
+        assert_identical(store.model(model["nwmd"]).load(), model)
@@ -0,0 +1,99 @@
+"""
+Round-trip tests for model_format (no GENEC needed): python -m pytest
+"""
+import numpy
+import pytest
+
+from model_format import encode_model, read_model, write_model
+
+
+def new_model(number_of_zones=50):
+    random = numpy.random.default_rng(1)
+    return {
+        "nwmd": 12,
+        "alter": 1.5e7,
+        "name": "star",
+        "converged": True,
+        "missing": None,
+        "radius": random.random(number_of_zones),
+        "zones": numpy.arange(number_of_zones, dtype=numpy.int32),
+        "abundances": random.random((3, number_of_zones)),
+        "empty": numpy.zeros(0),
+        "flags": [1, 2, 3],
+        "nested": {"a": 1},
+    }
+
+
+def assert_models_equal(model, expected):
+    assert list(model.keys()) == list(expected.keys())
+    for name, value in expected.items():
+        if isinstance(value, numpy.ndarray):
+            assert model[name].dtype == value.dtype
+            numpy.testing.assert_array_equal(model[name], value)
+        else:
+            assert model[name] == value
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(tmp_path, compress):
+    model = new_model()
+    filename = str(tmp_path / "star.gmod")
+    write_model(model, filename, compress=compress)
+    assert_models_equal(read_model(filename).load(), model)
+
+
+def test_lazy_scalars_and_arrays(tmp_path):
+    model = new_model()
+    filename = str(tmp_path / "star.gmod")
+    write_model(model, filename)
+    lazy = read_model(filename)
+    assert lazy.scalars["nwmd"] == 12
+    assert isinstance(lazy["radius"], numpy.memmap)
+    numpy.testing.assert_array_equal(lazy["abundances"], model["abundances"])
+
+
+def test_float32(tmp_path):
+    model = new_model()
+    filename = str(tmp_path / "star.gmod")
+    write_model(model, filename, float32=True)
+    loaded = read_model(filename).load()
+    assert loaded["radius"].dtype == numpy.float64
+    numpy.testing.assert_allclose(loaded["radius"], model["radius"], rtol=1e-7)
+    numpy.testing.assert_array_equal(loaded["zones"], model["zones"])
+
+
+def test_models_at_offset(tmp_path):
+    first = new_model(10)
+    second = new_model(20)
+    filename = str(tmp_path / "stars.gmod")
+    with open(filename, "wb") as outstream:
+        outstream.write(encode_model(first))
+        offset = outstream.tell()
+        outstream.write(encode_model(second, compress=True))
+    assert_models_equal(read_model(filename).load(), first)
+    assert_models_equal(read_model(filename, offset).load(), second)
+
+
+def test_not_a_model(tmp_path):
+    filename = tmp_path / "other"
+    filename.write_bytes(b"x" * 64)
+    with pytest.raises(ValueError):
+        read_model(str(filename))
+
+
+@pytest.mark.parametrize("value", [
+    [1, "x"],
+    [1, 2.5],
+    [[1, 2], [3]],
+    [True, 2],
+    (1, 2),
+    [(1, 2), (3, 4)],
+    [],
+    [[1.5, 2.5], [3.5, 4.5]],
+])
+def test_lists_round_trip(tmp_path, value):
+    filename = str(tmp_path / "star.gmod")
+    write_model({"value": value}, filename)
+    loaded = read_model(filename).load()["value"]
+    assert type(loaded) is type(value)
+    assert repr(loaded) == repr(value)
@@ -0,0 +1,97 @@
+"""
+Tests for track_store (no GENEC needed):
+python -m pytest
+"""
+import os
+
+import numpy
+import pytest
+
+from track_store import INDEX_DTYPE, TrackStore
+
+
+def new_model(nwmd):
+    return {
+        "nwmd": nwmd,
+        "alter": 1e5 * nwmd,
+        "name": "star",
+        "radius": numpy.linspace(0, 1, 10) * (1 + nwmd),
+    }
+
+
+def assert_model(model, nwmd):
+    expected = new_model(nwmd)
+    assert model["nwmd"] == nwmd
+    assert model["alter"] == expected["alter"]
+    numpy.testing.assert_array_equal(model["radius"], expected["radius"])
+
+
+@pytest.mark.parametrize("keyframe_every", [None, 2])
+def test_reopen_and_append(tmp_path, keyframe_every):
+    name = str(tmp_path / "star")
+    store = TrackStore(name, keyframe_every=keyframe_every)
+    for nwmd in range(3):
+        store.append(new_model(nwmd))
+    store = TrackStore(name, keyframe_every=keyframe_every)
+    assert len(store) == 3
+    for nwmd in range(3, 6):
+        store.append(new_model(nwmd))
+    store = TrackStore(name)
+    assert list(store.numbers) == list(range(6))
+    for nwmd in range(6):
+        assert_model(store.model(nwmd).load(), nwmd)
+    assert_model(store.model().load(), 5)
+
+
+def test_truncated_index(tmp_path):
+    name = str(tmp_path / "star")
+    store = TrackStore(name)
+    for nwmd in range(3):
+        store.append(new_model(nwmd))
+    # a record that was only partly written
+    with open(store.index_filename, "ab") as outstream:
+        outstream.write(b"\x01" * (INDEX_DTYPE.itemsize // 2))
+    store = TrackStore(name)
+    assert len(store) == 3
+    assert os.path.getsize(store.index_filename) == 3 * INDEX_DTYPE.itemsize
+    store.append(new_model(3))
+    store = TrackStore(name)
+    assert list(store.numbers) == list(range(4))
+    for nwmd in range(4):
+        assert_model(store.model(nwmd).load(), nwmd)
+
+
+def test_incomplete_model(tmp_path):
+    name = str(tmp_path / "star")
+    store = TrackStore(name)
+    for nwmd in range(3):
+        store.append(new_model(nwmd))
+    # the index record was written, but the model wasn't
+    os.truncate(store.filename, int(store.index["offset"][-1]) + 4)
+    store = TrackStore(name)
+    assert list(store.numbers) == [0, 1]
+    store.append(new_model(2))
+    assert_model(TrackStore(name).model(2).load(), 2)
+
+
+def test_model_at_age_and_history(tmp_path):
+    store = TrackStore(str(tmp_path / "star"), keyframe_every=2)
+    for nwmd in range(5):
+        store.append(new_model(nwmd))
+    assert_model(store.model_at_age(2.5e5), 2)
+    assert_model(store.model_at_age(4e5), 4)
+    with pytest.raises(KeyError):
+        store.model_at_age(-1)
+    history = store.scalar_history()
+    numpy.testing.assert_array_equal(history["nwmd"], range(5))
+    numpy.testing.assert_array_equal(history["alter"], 1e5 * numpy.arange(5))
+    assert list(history["name"]) == ["star"] * 5
+
+
+def test_deltas_are_compressed(tmp_path):
+    assert TrackStore(str(tmp_path / "star"), keyframe_every=2).compress
+    assert not TrackStore(str(tmp_path / "other")).compress
+    with pytest.raises(ValueError):
+        TrackStore(str(tmp_path / "star"), compress=False, keyframe_every=2)
+    with pytest.raises(ValueError):
+        TrackStore(str(tmp_path / "star"), float32=True, keyframe_every=2)
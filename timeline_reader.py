@@ -0,0 +1,148 @@
+"""
+Fast reader for the timeline (history) of a star in an AMUSE HDF5 file, as
+written by write_set_to_file(..., append_to_file=True) or TimelineWriter.
+read_set_from_file and get_timeline_of_attribute_as_vector build the
+particle set of every stored step and walk them once per attribute. This
+reader uses h5py directly: it reads the timestamps of all steps once, and
+then any number of attributes in one pass, as plain numpy arrays in the
+units they are stored in (see units):
+
+    with TimelineReader("star-1.amuse") as timeline:
+        columns = timeline.columns(["radius", "luminosity"])
+        radius = timeline.quantity("radius", end=10 | units.Myr)
+        age = timeline.ages(end=10 | units.Myr)
+
+Only the steps in the age range are read; columns of all steps are kept,
+so asking for them again is free.
+"""
+import h5py
+import numpy
+
+from amuse.units import core
+from amuse.units.quantities import is_quantity
+
+
+def _string(value):
+    if isinstance(value, bytes):
+        return value.decode("ascii")
+    return str(value)
+
+
+def to_unit(unit_string):
+    "The unit of a unit string stored by AMUSE, or None for none"
+    if unit_string in ("none", ""):
+        return None
+    return eval(unit_string, core.__dict__)
+
+
+class TimelineReader:
+    """
+    Timeline of the particle with number particle (in the stored sets) in
+    filename. The file is opened when it is first needed.
+    """
+    def __init__(self, filename, particle=0):
+        self.filename = filename
+        self.particle = particle
+        self.file = None
+        self.groups = None
+        self.timestamps = None
+        self.age_unit = None
+        self.units = {}
+        self.__columns = {}
+
+    def open(self):
+        if self.file is not None:
+            return
+        self.file = h5py.File(self.filename, "r")
+        # sets are stored in groups with increasing, zero-padded names
+        particles = self.file["particles"]
+        self.groups = [particles[name] for name in sorted(particles.keys())]
+        self.timestamps = numpy.array(
+            [group.attrs.get("timestamp", numpy.nan) for group in self.groups],
+            dtype=float,
+        )
+        if self.groups and "timestamp_unit" in self.groups[0].attrs:
+            self.age_unit = to_unit(
+                _string(self.groups[0].attrs["timestamp_unit"])
+            )
+        if self.groups:
+            for name, dataset in self.groups[0]["attributes"].items():
+                self.units[name] = _string(dataset.attrs.get("units", "none"))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __len__(self):
+        self.open()
+        return len(self.groups)
+
+    @property
+    def attribute_names(self):
+        self.open()
+        return list(self.units.keys())
+
+    def rows(self, start=None, end=None):
+        "The slice of the stored steps with start <= age <= end"
+        self.open()
+        if is_quantity(start):
+            start = start.value_in(self.age_unit)
+        if is_quantity(end):
+            end = end.value_in(self.age_unit)
+        first = 0 if start is None else numpy.searchsorted(
+            self.timestamps, start, side="left"
+        )
+        last = len(self.groups) if end is None else numpy.searchsorted(
+            self.timestamps, end, side="right"
+        )
+        return slice(first, last)
+
+    def columns(self, names, start=None, end=None):
+        """
+        The attributes in names of all steps with an age between start and
+        end (numbers in the timestamp unit, or quantities), as a dict of
+        numpy arrays. Attributes that weren't read before are read in a
+        single pass over the steps in the age range; they are kept when
+        all steps are read.
+        """
+        self.open()
+        rows = self.rows(start, end)
+        all_rows = rows.start == 0 and rows.stop == len(self.groups)
+        columns = {
+            name: self.__columns[name][rows]
+            for name in names if name in self.__columns
+        }
+        missing = [name for name in names if name not in columns]
+        if missing:
+            values = {name: [] for name in missing}
+            for group in self.groups[rows]:
+                attributes = group["attributes"]
+                for name in missing:
+                    values[name].append(attributes[name][self.particle])
+            for name in missing:
+                columns[name] = numpy.array(values[name])
+                if all_rows:
+                    self.__columns[name] = columns[name]
+        return {name: columns[name] for name in names}
+
+    def column(self, name, start=None, end=None):
+        return self.columns([name], start, end)[name]
+
+    def quantity(self, name, start=None, end=None):
+        "The attribute name as a quantity, see columns"
+        unit = to_unit(self.units[name])
+        values = self.column(name, start, end)
+        return values if unit is None else values | unit
+
+    def ages(self, start=None, end=None):
+        "The timestamps of the steps between start and end, as a quantity"
+        self.open()
+        ages = self.timestamps[self.rows(start, end)]
+        return ages if self.age_unit is None else ages | self.age_unit
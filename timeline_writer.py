@@ -0,0 +1,75 @@
+"""
+Streaming writer for the timeline (history) of a star.
+write_set_to_file(..., append_to_file=True) opens, appends to and closes
+the file for every snapshot, which gets slower as the file grows. A
+TimelineWriter keeps the file open, collects snapshots in memory and
+writes them buffer_size at a time. The file is a normal AMUSE HDF5 file
+with one timestamped set per snapshot, so it can be read as before:
+
+    with TimelineWriter(f"star-{star.key}.amuse") as timeline:
+        ...
+        timeline.add(star.as_set(), star.age)
+
+    star = read_set_from_file(f"star-{star.key}.amuse")[0]
+    age, radius = star.get_timeline_of_attribute_as_vector("radius")
+
+Snapshots still in the buffer are lost if the process is killed, so the
+writer must be closed (or flushed) at the end of a run.
+"""
+from amuse.io.store_v2 import StoreHDF
+
+
+class TimelineWriter:
+    def __init__(
+        self, filename, buffer_size=10, append=True, compression=True
+    ):
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self.append = append
+        self.compression = compression
+        self.buffer = []
+        self.store = None
+
+    def __len__(self):
+        "Number of snapshots that have not been written yet"
+        return len(self.buffer)
+
+    def add(self, particles, timestamp=None):
+        """
+        Add a snapshot of particles (copied, so they can be changed
+        afterwards), written once the buffer is full
+        """
+        self.buffer.append((particles.copy(), timestamp))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        "Write all buffered snapshots"
+        if not self.buffer:
+            return
+        if self.store is None:
+            self.store = StoreHDF(
+                self.filename,
+                append_to_file=self.append,
+                compression=self.compression,
+            )
+        for particles, timestamp in self.buffer:
+            extra_attributes = {}
+            if timestamp is not None:
+                extra_attributes["timestamp"] = timestamp
+            self.store.store(particles, extra_attributes)
+        self.store.hdf5file.flush()
+        self.buffer = []
+
+    def close(self):
+        "Write what is left and close the file"
+        self.flush()
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
@@ -0,0 +1,172 @@
+"""
+Append-only store for all GENEC models of one star.
+
+A track store is two files: `<name>.track` with the models one after the
+other (in the format of model_format), and `<name>.track.idx` with one
+fixed-size record (model number nwmd, age, offset, size) per model. The
+index is small, so it is read at once; any model can then be read with a
+single seek, and the scalar history of a track only needs the model
+headers, not the profiles.
+
+    store = TrackStore("MyStar")
+    store.append(model)
+    model = store.model(nwmd).load()          # or store.model() for the last
+    history = store.scalar_history()
+
+With keyframe_every=N, only every N-th model is stored in full, and the
+others as exact deltas to the model before them (see model_delta); reading
+such a model applies the deltas since the last full model.
+"""
+import numpy
+
+from model_format import encode_model, read_header, read_model
+from model_delta import DELTA_BASE, make_delta, apply_delta
+from index_file import load_index
+
+INDEX_DTYPE = numpy.dtype([
+    ("nwmd", "<i8"),
+    ("age", "<f8"),
+    ("offset", "<u8"),
+    ("size", "<u8"),
+])
+# names of the age field in a model, in order of preference
+AGE_FIELDS = ("alter", "age")
+
+
+class LoadedModel(dict):
+    "A model that has been read completely"
+    def load(self):
+        return dict(self)
+
+
+class TrackStore:
+    """
+    Track store for one star. Models are appended with append(); float32
+    and compress are passed on to model_format.encode_model. With
+    keyframe_every, models are stored as deltas between full models; these
+    are always compressed (uncompressed deltas are as large as the models)
+    and can't be float32. compress defaults to compressing only then.
+    """
+    def __init__(
+        self, name, float32=False, compress=None, keyframe_every=None
+    ):
+        if keyframe_every is not None:
+            if float32:
+                raise ValueError("deltas can't be stored as float32")
+            if compress is False:
+                raise ValueError("deltas must be compressed")
+            compress = True
+        self.filename = name + ".track"
+        self.index_filename = self.filename + ".idx"
+        self.float32 = float32
+        self.compress = bool(compress)
+        self.keyframe_every = keyframe_every
+        self.__previous = None
+        self.index = load_index(
+            self.index_filename, INDEX_DTYPE, self.filename,
+            lambda records: records["size"],
+        )
+        self.__rows = {
+            int(nwmd): row for row, nwmd in enumerate(self.index["nwmd"])
+        }
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def numbers(self):
+        "Model numbers (nwmd) of the stored models"
+        return self.index["nwmd"]
+
+    @property
+    def ages(self):
+        return self.index["age"]
+
+    def append(self, model, age=None):
+        """
+        Append a model (a dict from get_internal_structure). The age is
+        taken from the model unless given.
+        """
+        if age is None:
+            age = next(
+                (model[name] for name in AGE_FIELDS if name in model),
+                numpy.nan,
+            )
+        record = model
+        if (
+            self.keyframe_every is not None
+            and len(self) % self.keyframe_every != 0
+        ):
+            if self.__previous is None:
+                self.__previous = self.model().load()
+            record = make_delta(
+                self.__previous, model, base=int(self.index["nwmd"][-1])
+            )
+        data = encode_model(
+            record, float32=self.float32, compress=self.compress
+        )
+        with open(self.filename, "ab") as outstream:
+            offset = outstream.tell()
+            outstream.write(data)
+        record = numpy.array(
+            [(model["nwmd"], age, offset, len(data))], dtype=INDEX_DTYPE
+        )
+        with open(self.index_filename, "ab") as outstream:
+            record.tofile(outstream)
+        self.index = numpy.concatenate([self.index, record])
+        self.__rows[int(model["nwmd"])] = len(self.index) - 1
+        if self.keyframe_every is not None:
+            self.__previous = model
+
+    def model(self, nwmd=None):
+        """
+        The model with number nwmd (default: the last one). Full models
+        are read lazily, models stored as deltas are reconstructed.
+        """
+        row = len(self) - 1 if nwmd is None else self.__rows[nwmd]
+        return self.__read(row)
+
+    def model_at_age(self, age):
+        "The last model with an age of at most age"
+        row = numpy.searchsorted(self.index["age"], age, side="right") - 1
+        if row < 0:
+            raise KeyError(f"no model before age {age}")
+        return self.__read(row)
+
+    def __read(self, row):
+        records = [read_model(self.filename, int(self.index["offset"][row]))]
+        while DELTA_BASE in records[-1].scalars:
+            row -= 1
+            records.append(
+                read_model(self.filename, int(self.index["offset"][row]))
+            )
+        if len(records) == 1:
+            return records[0]
+        model = records.pop().load()
+        while records:
+            model = apply_delta(model, records.pop())
+        return LoadedModel(model)
+
+    def scalar_history(self, names=None):
+        """
+        The scalar fields of all models (or only those in names), as a dict
+        of arrays. Only the model headers are read.
+        """
+        history = {}
+        with open(self.filename, "rb") as instream:
+            for row, offset in enumerate(self.index["offset"]):
+                scalars = read_header(instream, int(offset))[0]["scalars"]
+                delta = scalars.pop(DELTA_BASE, False) is not False
+                for name, value in scalars.items():
+                    if names is not None and name not in names:
+                        continue
+                    if name not in history:
+                        history[name] = [None] * row
+                    history[name].append(value)
+                for name in history:
+                    if len(history[name]) <= row:
+                        # unchanged scalars are not stored in deltas
+                        history[name].append(
+                            history[name][-1] if delta and row > 0 else None
+                        )
+        return {name: numpy.array(values) for name, values in history.items()}
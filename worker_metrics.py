@@ -0,0 +1,128 @@
+"""
+Per-worker performance metrics for GenecMultiple.
+Every evolve_one_step of every worker is recorded as one row, with the wall
+time of the step, the time the worker sat idle before it was dispatched
+(e.g. at a barrier), the time spent in state queries for it, and the
+simulated time it covered.
+"""
+
+import csv
+from time import perf_counter
+
+COLUMNS = (
+    "worker", "star", "round", "start", "wall_time", "idle_time",
+    "rpc_time", "age", "simulated_time", "speed",
+)
+
+
+class WorkerMetrics:
+    """
+    Records per worker and per step (round): wall time in evolve_one_step,
+    idle time, RPC time, age reached, simulated time (yr) and speed
+    (Myr per wall-clock minute). Times are in seconds since creation.
+    """
+    def __init__(self):
+        self.rows = []
+        self.time_start = perf_counter()
+        self.__running = {}
+        self.__finished = {}
+        self.__rpc_time = {}
+        self.__rounds = {}
+
+    def add_rpc(self, worker, seconds):
+        "Add time spent in state queries for worker, counted to its next step"
+        self.__rpc_time[worker] = self.__rpc_time.get(worker, 0.) + seconds
+
+    def add_batch_rpc(self, workers, seconds):
+        """
+        Add the time of one round of requests to all workers in workers,
+        shared equally so that the sum over workers is the time spent
+        """
+        workers = list(workers)
+        if not workers:
+            return
+        for worker in workers:
+            self.add_rpc(worker, seconds / len(workers))
+
+    def step_started(self, worker, star, age):
+        "Worker starts a step of star (a key) at age (yr)"
+        now = perf_counter()
+        self.__running[worker] = {
+            "worker": worker,
+            "star": star,
+            "round": self.__rounds.get(worker, 0),
+            "start": now - self.time_start,
+            "wall_time": None,
+            "idle_time": now - self.__finished.get(worker, now),
+            "rpc_time": self.__rpc_time.pop(worker, 0.),
+            "age": age,
+        }
+        self.__rounds[worker] = self.__rounds.get(worker, 0) + 1
+
+    def step_finished(self, worker):
+        "The step of worker has completed"
+        now = perf_counter()
+        row = self.__running[worker]
+        row["wall_time"] = now - self.time_start - row["start"]
+        self.__finished[worker] = now
+
+    def step_synchronised(self, worker, age):
+        "The star of worker is known to be at age (yr) after its step"
+        row = self.__running.pop(worker)
+        row["simulated_time"] = age - row["age"]
+        row["age"] = age
+        row["speed"] = (
+            (row["simulated_time"] / 1e6) / (row["wall_time"] / 60)
+            if row["wall_time"] > 0 else 0.
+        )
+        self.rows.append(row)
+
+    def select(self, worker=None, star=None):
+        "Rows for one worker and/or star"
+        return [
+            row for row in self.rows
+            if (worker is None or row["worker"] == worker)
+            and (star is None or row["star"] == star)
+        ]
+
+    def summary(self):
+        """
+        Totals per worker: steps, wall, idle and RPC time, simulated time
+        (yr), speed (Myr/minute) and utilisation (fraction of time spent
+        stepping).
+        """
+        summary = {}
+        for row in self.rows:
+            total = summary.setdefault(row["worker"], {
+                "steps": 0, "wall_time": 0., "idle_time": 0.,
+                "rpc_time": 0., "simulated_time": 0.,
+            })
+            total["steps"] += 1
+            total["star"] = row["star"]
+            for column in (
+                "wall_time", "idle_time", "rpc_time", "simulated_time"
+            ):
+                total[column] += row[column]
+        for total in summary.values():
+            busy = total["wall_time"]
+            elapsed = busy + total["idle_time"] + total["rpc_time"]
+            total["speed"] = (
+                (total["simulated_time"] / 1e6) / (busy / 60)
+                if busy > 0 else 0.
+            )
+            total["utilisation"] = busy / elapsed if elapsed > 0 else 0.
+        return summary
+
+    def bottleneck(self):
+        "The worker that spent the most time stepping, i.e. the slowest one"
+        summary = self.summary()
+        if not summary:
+            return None
+        return max(summary, key=lambda worker: summary[worker]["wall_time"])
+
+    def to_csv(self, filename):
+        "Write all rows to a CSV file"
+        with open(filename, "w", newline="") as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.rows)
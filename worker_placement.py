@@ -0,0 +1,201 @@
+"""
+CPU placement of GENEC workers.
+A worker process forked by the driver inherits the CPU affinity of the
+thread that starts it, so the starting thread is pinned to the cores of a
+worker while the worker is spawned, and restored afterwards. Workers that
+are started by an MPI runtime or its daemon don't inherit it (and the
+runtime may bind them itself), so after a worker has started, the new
+processes are pinned by pid as well: the worker process(es) to the cores
+of the worker, and launchers (processes with children, e.g. mpiexec or a
+daemon) back to the cores of the driver's thread. Workers are therefore
+started one at a time. Linux only; elsewhere placement is a no-op.
+"""
+
+import os
+import glob
+import threading
+from contextlib import contextmanager
+
+
+def cpu_sockets(cpus=None):
+    "Return a dict of socket id -> sorted list of the given (or usable) cpus"
+    if cpus is None:
+        cpus = os.sched_getaffinity(0)
+    sockets = {}
+    for cpu in sorted(cpus):
+        try:
+            with open(
+                f"/sys/devices/system/cpu/cpu{cpu}/topology/"
+                "physical_package_id"
+            ) as infile:
+                socket = int(infile.read())
+        except (OSError, ValueError):
+            socket = 0
+        sockets.setdefault(socket, []).append(cpu)
+    return sockets
+
+
+def process_parents():
+    "Return a dict of pid -> parent pid of all processes"
+    parents = {}
+    for stat in glob.glob("/proc/[0-9]*/stat"):
+        try:
+            with open(stat) as infile:
+                fields = infile.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        parents[int(stat.split("/")[2])] = int(fields[1])
+    return parents
+
+
+def child_processes(pid=None, parents=None):
+    "Return the pids of all descendants of process pid (default: this one)"
+    if pid is None:
+        pid = os.getpid()
+    if parents is None:
+        parents = process_parents()
+    descendants = []
+    generation = [pid]
+    while generation:
+        generation = [
+            child for child, parent in parents.items()
+            if parent in generation
+        ]
+        descendants.extend(generation)
+    return descendants
+
+
+def set_process_affinity(pid, cores):
+    "Pin all threads of process pid to cores, if it still exists"
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        tasks = [pid]
+    for task in tasks:
+        try:
+            os.sched_setaffinity(int(task), cores)
+        except OSError:
+            continue
+
+
+class WorkerPlacement:
+    """
+    Assigns cores to workers.
+
+    policy is "compact" (fill one socket before the next) or "spread"
+    (round-robin over sockets). The first reserved_cores cores are kept for
+    the driver process, and each worker gets cores_per_worker cores. If
+    there are more workers than free cores, assignments wrap around.
+    """
+    def __init__(self, policy="compact", cores_per_worker=1, reserved_cores=1):
+        if policy not in ("compact", "spread"):
+            raise ValueError(f"unknown placement policy '{policy}'")
+        self.policy = policy
+        self.cores_per_worker = cores_per_worker
+        self.supported = hasattr(os, "sched_setaffinity")
+        sockets = cpu_sockets() if self.supported else {0: [0]}
+        cores = [cpu for socket in sorted(sockets) for cpu in sockets[socket]]
+        self.driver_cores = cores[:reserved_cores]
+        for socket in sockets:
+            sockets[socket] = [
+                cpu for cpu in sockets[socket] if cpu not in self.driver_cores
+            ]
+        if policy == "compact":
+            order = [
+                cpu for socket in sorted(sockets) for cpu in sockets[socket]
+            ]
+        else:
+            order = []
+            queues = [list(sockets[socket]) for socket in sorted(sockets)]
+            while any(queues):
+                for queue in queues:
+                    # keep the cores of one worker on one socket
+                    order.extend(queue[:cores_per_worker])
+                    del queue[:cores_per_worker]
+        self.order = order or cores
+        self.assigned = {}
+        # the pids of the processes of every worker
+        self.processes = {}
+        self.lock = threading.Lock()
+
+    def cores_of(self, index):
+        "Cores for worker number index"
+        start = index * self.cores_per_worker
+        number_of_cores = len(self.order)
+        if start + self.cores_per_worker > number_of_cores:
+            print(f"Worker {index} oversubscribes its cores")
+        return sorted(set(
+            self.order[(start + i) % number_of_cores]
+            for i in range(self.cores_per_worker)
+        ))
+
+    @contextmanager
+    def pinned(self, index):
+        """
+        Start worker index in the with block: the calling thread is pinned
+        to the cores of the worker meanwhile, and the processes started in
+        the block are pinned by pid afterwards
+        """
+        cores = self.cores_of(index)
+        self.assigned[index] = cores
+        if not self.supported:
+            yield cores
+            return
+        with self.lock:
+            before = set(child_processes())
+            previous = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, cores)
+            try:
+                yield cores
+            finally:
+                os.sched_setaffinity(0, previous)
+            parents = process_parents()
+            started = set(child_processes(parents=parents)) - before
+            # the worker processes are the ones that haven't started others
+            launchers = set(parents[pid] for pid in started)
+            workers = sorted(started - launchers)
+            for pid in started & launchers:
+                set_process_affinity(pid, previous)
+            for pid in workers:
+                set_process_affinity(pid, cores)
+            self.processes[index] = workers
+
+    def pin_driver(self):
+        "Pin the calling (driver) thread to the reserved cores"
+        if self.supported and self.driver_cores:
+            os.sched_setaffinity(0, self.driver_cores)
+
+    def report(self):
+        """
+        Return the placement: the driver cores, per worker index its
+        assigned cores and the actual affinity of its processes (pid ->
+        cores), and the affinity of the other child processes (launchers).
+        """
+        affinity = {}
+        if self.supported:
+            for pid in child_processes():
+                try:
+                    affinity[pid] = sorted(os.sched_getaffinity(pid))
+                except OSError:
+                    continue
+        workers = {}
+        for index, cores in self.assigned.items():
+            pids = self.processes.get(index, [])
+            workers[index] = {
+                "cores": cores,
+                "processes": {
+                    pid: affinity[pid] for pid in pids if pid in affinity
+                },
+            }
+        worker_pids = set(
+            pid for pids in self.processes.values() for pid in pids
+        )
+        return {
+            "policy": self.policy,
+            "driver": list(self.driver_cores),
+            "workers": workers,
+            "other_processes": {
+                pid: cores for pid, cores in affinity.items()
+                if pid not in worker_pids
+            },
+        }